@@ -0,0 +1,253 @@
+"""Benchmarks for the nethervortex engine overhead.
+
+Run ``python bench_nethervortex.py`` to print the results as JSON, or
+``python bench_nethervortex.py --out base.json`` to save them and
+``--compare base.json`` to report the ratio of every timing against an
+earlier run.  Everything runs locally; ``--quick`` shrinks the sizes.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from nethervortex import Flow, Node, SharedData
+
+try:
+    from nethervortex import ParallelStep
+except ImportError:
+    ParallelStep = None
+
+
+def measure(fn, number, repeat=5):
+    """Time ``repeat`` batches of ``number`` calls to ``fn``.
+
+    Returns the best and median seconds per call.
+    """
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {"best": min(times), "median": statistics.median(times),
+            "number": number, "repeat": repeat}
+
+
+class LoopNode(Node):
+    """Loops ``shared["cmpnt"]["L"]["limit"]`` times without work."""
+    COMP = "L"
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        comp = shared["cmpnt"]["L"]
+        comp["n"] += 1
+        return "again" if comp["n"] < comp["limit"] else "done"
+
+
+class PrepNode(Node):
+    """Reads one config key, so ``_prep`` binds a single argument."""
+    COMP = "P"
+
+    # pylint: disable=W0613
+    def prelude(self, shared, *, key0=None, **_):
+        return key0
+
+
+class KwargsPrepNode(Node):
+    """Reads its ``**kwargs``, so ``_prep`` merges the whole config."""
+    COMP = "P"
+
+    # pylint: disable=W0613
+    def prelude(self, shared, **kwargs):
+        return kwargs.get("key0")
+
+
+class NoopNode(Node):
+    """A task that returns straight away."""
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        return "done"
+
+
+class RetryNode(Node):
+    """Fails the first dispatch of every run when asked to."""
+    COMP = "R"
+
+    # pylint: disable=W0613
+    def prelude(self, shared, **_):
+        return shared["cmpnt"]["R"]
+
+    def dispatch(self, prelude_res, **_):
+        prelude_res["calls"] += 1
+        if prelude_res["fail"] and prelude_res["calls"] == 1:
+            raise ValueError("retry me")
+
+
+class SpinNode(Node):
+    """Burns a little CPU, like a node doing real work."""
+
+    # pylint: disable=W0613
+    def dispatch(self, prelude_res, **_):
+        return sum(range(2000))
+
+
+def bench_transitions(quick):
+    """Per-transition cost of a self-looping no-op node."""
+    limit = 1000 if quick else 10000
+    loop = LoopNode()
+    loop - "again" >> loop
+    results = []
+    for compiled in (False, True):
+        flow = Flow(start=loop)
+        if compiled:
+            flow.compile()
+
+        def run():
+            flow.run(SharedData(config={}, state=None,
+                                cmpnt={"L": {"n": 0, "limit": limit}}))
+
+        timing = measure(run, 1, 3 if quick else 5)
+        results.append({"compiled": compiled, "transitions": limit,
+                        "per_transition": timing["best"] / limit,
+                        **timing})
+    loop.successors.clear()
+    return results
+
+
+# pylint: disable=W0212
+def bench_prep(quick):
+    """``Node._prep`` cost against the size of the config."""
+    declared, kwargs = PrepNode(), KwargsPrepNode()
+    results = []
+    for size in (10, 100, 1000) if quick else (10, 100, 1000, 10000):
+        shared = SharedData(config={f"key{i}": i for i in range(size)},
+                            state=None,
+                            cmpnt={"P": {"config": {"key0": -1}}})
+        results.append({
+            "config_size": size,
+            "declared": measure(lambda shared=shared:
+                                declared._prep(shared), 1000)["best"],
+            "kwargs": measure(lambda shared=shared:
+                              kwargs._prep(shared), 100)["best"]})
+    return results
+
+
+def bench_parallel(quick):
+    """ParallelStep cost against the number of tasks."""
+    if ParallelStep is None:
+        return {"skipped": "pykka is not installed"}
+    task = NoopNode()
+    results = []
+    for width in (1, 2, 4, 8) if quick else (1, 2, 4, 8, 16, 32):
+        step = ParallelStep(collect="all")[(task,) * width]
+        timing = measure(lambda step=step: step.run(
+            SharedData(config={}, cmpnt={}, state=None)),
+            20 if quick else 100)
+        results.append({"width": width, "per_task": timing["best"] / width,
+                        **timing})
+    return results
+
+
+def bench_retry(quick):
+    """Cost of a failed first attempt retried without waiting."""
+    RetryNode(retry_waits=[0])
+    flow = Flow(start=RetryNode())
+    results = []
+    for fail in (False, True):
+
+        def run(fail=fail):
+            flow.run(SharedData(config={}, state=None,
+                                cmpnt={"R": {"calls": 0, "fail": fail}}))
+
+        results.append({"fail_first": fail,
+                        **measure(run, 200 if quick else 2000)})
+    results[1]["retry_cost"] = results[1]["best"] - results[0]["best"]
+    return results
+
+
+def bench_concurrency(quick):
+    """Throughput of ``run_many`` over many small flows by thread
+    count."""
+    flow = Flow(start=SpinNode())
+    count = 200 if quick else 2000
+    results = []
+    for threads in (1, 2, 4, 8):
+        inputs = [SharedData(config={}, cmpnt={}, state=None)
+                  for _ in range(count)]
+        start = time.perf_counter()
+        for _ in flow.run_many(inputs, concurrency=threads):
+            pass
+        elapsed = time.perf_counter() - start
+        results.append({"threads": threads, "flows": count,
+                        "seconds": elapsed,
+                        "flows_per_second": count / elapsed})
+    return results
+
+
+BENCHMARKS = {
+    "transitions": bench_transitions,
+    "prep": bench_prep,
+    "parallel": bench_parallel,
+    "retry": bench_retry,
+    "concurrency": bench_concurrency,
+}
+
+
+def compare(results, baseline):
+    """Ratios of every timing in ``results`` to the same one in
+    ``baseline``; above 1 means slower now."""
+    ratios = {}
+    keys = ("best", "per_transition", "per_task", "declared", "kwargs",
+            "seconds")
+    for name, rows in results["results"].items():
+        old_rows = baseline.get("results", {}).get(name)
+        if not isinstance(rows, list) or not isinstance(old_rows, list):
+            continue
+        for i, (new, old) in enumerate(zip(rows, old_rows)):
+            for key in keys:
+                if new.get(key) and old.get(key):
+                    ratios[f"{name}[{i}].{key}"] = new[key] / old[key]
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        help="run only these benchmarks")
+    parser.add_argument("--quick", action="store_true",
+                        help="use smaller sizes")
+    parser.add_argument("--out", help="write the JSON results here")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="report ratios against an earlier JSON run")
+    args = parser.parse_args(argv)
+
+    results = {"meta": {"python": sys.version.split()[0],
+                        "implementation": platform.python_implementation(),
+                        "machine": platform.machine(),
+                        "system": platform.system(),
+                        "cpus": os.cpu_count(),
+                        "quick": args.quick,
+                        "time": time.time()},
+               "results": {}}
+    for name in args.only or BENCHMARKS:
+        results["results"][name] = BENCHMARKS[name](args.quick)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            results["compare"] = compare(results, json.load(f))
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
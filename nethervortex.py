@@ -22,17 +22,480 @@
 
 """NetherVortex ultra-light pipeline for building Agents.
 """
+import asyncio
+import contextvars
+import dis
+import functools
+import hashlib
+import heapq
+import inspect
+import itertools
+import json
 import logging
+import os
+import pickle
+import queue
+import random
+import sqlite3
+import sys
+import threading
 import time
+import types
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed)
+from concurrent.futures import wait as _wait_futures
 from typing import Any, Required, TypedDict
 
 logger = logging.getLogger(__name__)
 
+_np = False
+
+def _numpy():
+    """NumPy, imported on first use by ``run_columns``, or ``None``."""
+    global _np # pylint: disable=W0603
+    if _np is False:
+        try:
+            import numpy # pylint: disable=C0415
+            _np = numpy
+        except ImportError:
+            _np = None
+    return _np
+
 class SharedData(TypedDict):
     config: Required[dict]
     cmpnt: dict
     state: Any
 
+class _LayeredConfig(Mapping):
+    """A read-only view of ``shared["config"]`` with a component's
+    config overlaid on it.
+
+    Lookups go to the overlay, then the base, so hooks that declare
+    their config keys cost one lookup per key whatever the size of the
+    config, and changes to either layer are seen at once.  The merged
+    dict is only built, once per view, for hooks reading ``**kwargs``.
+    """
+    __slots__ = ("base", "overlay", "_merged")
+
+    def __init__(self, base, overlay=None):
+        self.base, self.overlay, self._merged = base, overlay, None
+
+    @classmethod
+    def of(cls, shared, comp):
+        overlay = None
+        if comp is not None and comp in shared["cmpnt"]:
+            overlay = shared["cmpnt"][comp].get("config")
+        return cls(shared["config"], overlay or None)
+
+    def __getitem__(self, key):
+        overlay = self.overlay
+        if overlay is not None and key in overlay:
+            return overlay[key]
+        return self.base[key]
+
+    def __contains__(self, key):
+        return key in self.base or (self.overlay is not None and
+                                    key in self.overlay)
+
+    def __iter__(self):
+        return iter(self.merged())
+
+    def __len__(self):
+        return len(self.merged())
+
+    def merged(self):
+        if self._merged is None:
+            self._merged = dict(self.base)
+            if self.overlay is not None:
+                self._merged |= self.overlay
+        return self._merged
+
+# Observers of the flow run the current thread or task belongs to.
+_active_observers = contextvars.ContextVar("nethervortex_observers",
+                                           default=())
+
+def _reads_local(code, name):
+    """Whether the code object ever loads the local ``name``."""
+    if (name in code.co_cellvars or
+        "locals" in code.co_names or "vars" in code.co_names):
+        return True
+    for ins in dis.get_instructions(code):
+        if ins.opname.startswith("LOAD_") and (
+                ins.argval == name or
+                (isinstance(ins.argval, tuple) and name in ins.argval)):
+            return True
+    return False
+
+def _config_params(fn, npos):
+    """Names of the config keys a hook accepts.
+
+    ``npos`` is the number of leading positional parameters (including
+    ``self``) the engine passes itself.  Returns ``None`` when the hook
+    needs the whole config, i.e. it reads its ``**kwargs``.
+    """
+    try:
+        params = list(inspect.signature(fn).parameters.values())
+    except (TypeError, ValueError):
+        return None
+    code = getattr(fn, "__code__", None)
+    # Only trust the code to tell whether **kwargs is read when the
+    # signature is the code's own, not a decorated or overridden one.
+    if code is not None and inspect.unwrap(fn) is fn:
+        nargs = (code.co_argcount + code.co_kwonlyargcount +
+                 bool(code.co_flags & inspect.CO_VARARGS) +
+                 bool(code.co_flags & inspect.CO_VARKEYWORDS))
+        declared = tuple(p.name for p in params)
+        if code.co_varnames[max(0, nargs - len(declared)):nargs] != declared:
+            code = None
+    else:
+        code = None
+    names = []
+    for i, p in enumerate(params):
+        if p.kind is p.VAR_KEYWORD:
+            if code is None or _reads_local(code, p.name):
+                return None
+        elif (p.kind is p.KEYWORD_ONLY or
+              (p.kind is p.POSITIONAL_OR_KEYWORD and i >= npos)):
+            names.append(p.name)
+    return tuple(names)
+
+_HOOK_NAMES = ("prelude", "dispatch", "postlude")
+
+def _hook(owner, name, npos):
+    """Resolve the hook ``name`` of a Node subclass or instance.
+
+    Returns ``(fn, config_params, is_async)``, where ``fn`` is called
+    as ``fn(node, *args, **config)``, or ``(None, None, False)`` when
+    there is no such hook.  Plain functions defined on the class are
+    called directly; static and class methods, other callables and
+    hooks assigned on the instance go through ``getattr(node, name)``.
+    """
+    if not isinstance(owner, type) and name not in owner.__dict__:
+        owner = type(owner)
+    raw = (inspect.getattr_static(owner, name, None)
+           if isinstance(owner, type) else owner.__dict__[name])
+    if raw is None:
+        return None, None, False
+    if isinstance(owner, type) and isinstance(raw, types.FunctionType):
+        return (raw, _config_params(raw, npos),
+                inspect.iscoroutinefunction(raw))
+    try:
+        target = getattr(owner, name)
+    except AttributeError:
+        return None, None, False
+
+    def hook(node, *args, **kwargs):
+        return getattr(node, name)(*args, **kwargs)
+
+    return (hook, _config_params(target, npos - 1),
+            inspect.iscoroutinefunction(target))
+
+def _kwargs(names, cfg):
+    if names is None:
+        return cfg.merged()
+    return {k: cfg[k] for k in names if k in cfg}
+
+def _canonical(obj):
+    """A form of ``obj`` whose pickle does not depend on dict or set
+    ordering."""
+    if isinstance(obj, dict):
+        return ("dict", tuple(sorted(((_canonical(k), _canonical(v))
+                                      for k, v in obj.items()), key=repr)))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(_canonical(x) for x in obj))
+    if isinstance(obj, (set, frozenset)):
+        return ("set", tuple(sorted((_canonical(x) for x in obj), key=repr)))
+    return obj
+
+def _stable_digest(*parts):
+    """A content hash of ``parts`` that is stable across processes."""
+    data = pickle.dumps(_canonical(parts), protocol=4)
+    return hashlib.sha256(data).hexdigest()
+
+class Memo:
+    """A thread-safe LRU cache for the results of a node's ``dispatch``.
+
+    Declare it on a Node subclass, e.g. ``MEMO = Memo(maxsize=256,
+    ttl=60)``.  Results are keyed by the node class, ``prelude_res`` and
+    the config keys ``dispatch`` receives; entries older than ``ttl``
+    seconds are dropped and the least recently used entry is evicted
+    beyond ``maxsize``.  Exceptions are never cached.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize, self.ttl = maxsize, ttl
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """Return ``(True, value)`` on a hit, ``(False, None)`` otherwise."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[0] is None or
+                                      entry[0] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._data)}
+
+class DiskMemo:
+    """A ``Memo`` kept in a SQLite file under ``directory``.
+
+    Entries survive restarts and are shared by every process using the
+    same directory; keys are the same content hashes ``Memo`` uses.
+    The store is kept under ``max_bytes`` of pickled values by evicting
+    the least recently used entries, and entries older than ``ttl``
+    seconds are ignored.  A hit only records its use when the last
+    record is more than ``touch_interval`` seconds old, so hot entries
+    do not turn every lookup into a write.  Each thread and process
+    opens its own connection to the write-ahead-logged database.
+    """
+
+    EVICT_CHUNK = 64
+
+    # pylint: disable=R0913
+    def __init__(self, directory, max_bytes=256 << 20, ttl=None,
+                 filename="memo.sqlite", touch_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, filename)
+        self.max_bytes, self.ttl = max_bytes, ttl
+        self.touch_interval = touch_interval
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS memo ("
+                         "key TEXT PRIMARY KEY, value BLOB, size INTEGER,"
+                         " stored REAL, used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS memo_used"
+                         " ON memo (used)")
+            # The running byte total, so stores need not sum the table.
+            conn.execute("CREATE TABLE IF NOT EXISTS memo_meta ("
+                         "id INTEGER PRIMARY KEY CHECK (id = 0),"
+                         " bytes INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO memo_meta SELECT 0,"
+                         " COALESCE(SUM(size), 0) FROM memo")
+
+    def _conn(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            # Transactions are begun explicitly, see store().
+            local.conn = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("PRAGMA synchronous=NORMAL")
+            local.pid = os.getpid()
+        return local.conn
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, key):
+        """Return ``(True, value)`` on a hit, ``(False, None)`` otherwise."""
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, stored, used FROM memo"
+                           " WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl is not None and
+                           row[1] + self.ttl <= now):
+            self._count(False)
+            return False, None
+        if now - row[2] > self.touch_interval:
+            with conn:
+                conn.execute("UPDATE memo SET used = ? WHERE key = ?",
+                             (now, key))
+        self._count(True)
+        return True, pickle.loads(row[0])
+
+    def store(self, key, value):
+        data, now = pickle.dumps(value), time.time()
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = conn.execute("SELECT size FROM memo WHERE key = ?",
+                               (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?)",
+                         (key, data, len(data), now, now))
+            total = self._add_bytes(conn, len(data) - (old[0] if old else 0))
+            while total > self.max_bytes:
+                rows = conn.execute("SELECT key, size FROM memo"
+                                    " ORDER BY used LIMIT ?",
+                                    (self.EVICT_CHUNK,)).fetchall()
+                if not rows:
+                    break
+                evict, freed = [], 0
+                for k, size in rows:
+                    if total - freed <= self.max_bytes:
+                        break
+                    evict.append((k,))
+                    freed += size
+                conn.executemany("DELETE FROM memo WHERE key = ?", evict)
+                total = self._add_bytes(conn, -freed)
+
+    @staticmethod
+    def _add_bytes(conn, delta):
+        conn.execute("UPDATE memo_meta SET bytes = bytes + ? WHERE id = 0",
+                     (delta,))
+        return conn.execute("SELECT bytes FROM memo_meta").fetchone()[0]
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM memo")
+            conn.execute("UPDATE memo_meta SET bytes = 0")
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        conn = self._conn()
+        size = conn.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+        nbytes = conn.execute("SELECT bytes FROM memo_meta").fetchone()[0]
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": size, "bytes": nbytes}
+
+class _SingleFlight:
+    """Lets concurrent calls with the same key share one execution.
+
+    The first caller runs ``call``; callers arriving while it runs wait
+    and receive its result or exception.  A coroutine result is wrapped
+    in a task, which later callers await as well until it finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _forget(self, key, entry):
+        with self._lock:
+            if self._calls.get(key) is entry:
+                del self._calls[key]
+
+    def do(self, key, call):
+        with self._lock:
+            entry = self._calls.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            entry[0].wait()
+            if entry[2] is not None:
+                raise entry[2]
+            return entry[1]
+        forget = True
+        try:
+            res = call()
+            if inspect.isawaitable(res):
+                res = asyncio.ensure_future(res)
+                res.add_done_callback(lambda _: self._forget(key, entry))
+                forget = False
+            entry[1] = res
+            return res
+        except BaseException as exp:
+            entry[2] = exp
+            raise
+        finally:
+            if forget:
+                self._forget(key, entry)
+            entry[0].set()
+
+class _Batcher:
+    """Gathers concurrent dispatch calls of one node class into batches
+    for its ``dispatch_batch``.
+
+    Calls are grouped by the config keys ``dispatch_batch`` receives.
+    The first call of a group waits until ``max_size`` calls have joined
+    or ``max_wait`` seconds have passed, then runs the whole group with
+    one ``dispatch_batch`` call and hands every caller its own result,
+    or the exception.
+    """
+
+    def __init__(self, batch_fn, max_size, max_wait):
+        self.batch_fn = batch_fn
+        self.max_size, self.max_wait = max_size, max_wait
+        self._cond = threading.Condition()
+        self._open = {}
+
+    def dispatch(self, node, prelude_res, /, **kwargs):
+        try:
+            key = _stable_digest(kwargs)
+        # pylint: disable=W0718
+        except Exception:
+            return self.batch_fn(node, [prelude_res], **kwargs)[0]
+        # A slot is [prelude_res, done, result, error].
+        slot = [prelude_res, False, None, None]
+        with self._cond:
+            group = self._open.get(key)
+            leader = group is None
+            if leader:
+                group = self._open[key] = []
+            group.append(slot)
+            if len(group) >= self.max_size:
+                del self._open[key]
+                self._cond.notify_all()
+            if leader:
+                deadline = time.monotonic() + self.max_wait
+                while self._open.get(key) is group:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self._open[key]
+                        break
+                    self._cond.wait(remaining)
+            else:
+                while not slot[1]:
+                    self._cond.wait()
+        if leader:
+            self._run(node, group, kwargs)
+        if slot[3] is not None:
+            raise slot[3]
+        return slot[2]
+
+    def _run(self, node, group, kwargs):
+        try:
+            results = list(self.batch_fn(node, [s[0] for s in group],
+                                         **kwargs))
+            if len(results) != len(group):
+                raise ValueError(
+                    f"dispatch_batch returned {len(results)} results "
+                    f"for {len(group)} inputs")
+            outcomes = [(r, None) for r in results]
+        # pylint: disable=W0718
+        except Exception as exp:
+            outcomes = [(None, exp)] * len(group)
+        with self._cond:
+            for s, (res, err) in zip(group, outcomes):
+                s[1:] = True, res, err
+            self._cond.notify_all()
+
 class _Singleton(object):
     _instance = None
 
@@ -77,11 +540,20 @@ class BaseNode():
         t2 = self._post(shared, t0, t1)
         return t2
 
+    async def _run_async(self, shared):
+        return self._run(shared)
+
     def run(self, shared: SharedData):
         if self.successors:
             logger.warning("Successors are ignored in Node.run. Use Flow.")
         return self._run(shared)
 
+    async def run_async(self, shared: SharedData):
+        """Like ``run``, but hooks may be coroutines."""
+        if self.successors:
+            logger.warning("Successors are ignored in Node.run. Use Flow.")
+        return await self._run_async(shared)
+
     def __rshift__(self, other):
         return self.next(other)
 
@@ -98,9 +570,94 @@ class _TransHelper:
         return self.src.next(target, self.action)
 
 class Node(_Singleton, BaseNode):
-    """The Node class is the main place to put the logic."""
+    """The Node class is the main place to put the logic.
+
+    The ``prelude``, ``dispatch`` and ``postlude`` hooks and ``COMP``
+    are resolved once, when the subclass is created, into ``_hooks``
+    and ``_comp``.  Phases whose hook is missing are skipped.  Each hook
+    only receives the config keys it declares (``_hook_args``) unless
+    it actually reads its ``**kwargs``.  Static and class method hooks
+    work too, and assigning a hook on the instance re-resolves them.
+
+    Hooks may be coroutine functions; such nodes must be run with
+    ``run_async``, where retries wait with ``asyncio.sleep``.
+
+    A node may implement ``dispatch_batch(self, list_of_prelude_res,
+    **config)`` returning one result per input instead of ``dispatch``.
+    Concurrent dispatch calls are then collected into batches of up to
+    ``BATCH_SIZE`` calls, waiting at most ``BATCH_WAIT`` seconds.
+    ``dispatch_batch`` may not be a coroutine function.
+
+    ``MEMO`` may hold a ``Memo`` or ``DiskMemo`` caching ``dispatch``
+    results.  With ``COALESCE = True`` concurrent identical ``dispatch``
+    calls share one in-flight execution.
+    """
 
     _initialized: bool = False
+    _hooks: tuple = (None, None, None)
+    _hook_args: tuple = (None, None, None)
+    _comp = None
+    _name: str = "Node"
+    _idle: bool = True
+    _no_exec: bool = True
+    _is_async: bool = False
+    _resumable: bool = True
+    _memo = None
+    _flight = None
+    _batcher = None
+    BATCH_SIZE: int = 16
+    BATCH_WAIT: float = 0.005
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        batch, _, batch_async = _hook(cls, "dispatch_batch", 2)
+        if batch_async:
+            # The batcher groups callers across threads, not tasks.
+            raise TypeError(f"{cls.__name__}.dispatch_batch must not be a "
+                            "coroutine function; batching is only "
+                            "supported for synchronous nodes")
+        cls._batcher = (None if batch is None else
+                        _Batcher(batch, cls.BATCH_SIZE, cls.BATCH_WAIT))
+        cls._comp = getattr(cls, "COMP", None)
+        cls._memo = getattr(cls, "MEMO", None)
+        cls._flight = (_SingleFlight() if getattr(cls, "COALESCE", False)
+                       else None)
+        cls._name = cls.__name__
+        Node._bind_hooks(cls)
+
+    @staticmethod
+    def _bind_hooks(owner):
+        """Resolve the hooks of a Node subclass, or of an instance that
+        had a hook assigned, into ``_hooks`` and the derived flags."""
+        cls = owner if isinstance(owner, type) else type(owner)
+        resolved = [_hook(owner, h, n)
+                    for h, n in zip(_HOOK_NAMES, (2, 2, 4))]
+        if cls._batcher is not None and (
+                owner is cls or "dispatch" not in owner.__dict__):
+            batch = _hook(cls, "dispatch_batch", 2)
+            resolved[1] = (cls._batcher.dispatch, batch[1], batch[2])
+        owner._hooks = tuple(r[0] for r in resolved)
+        owner._hook_args = tuple(r[1] for r in resolved)
+        owner._is_async = any(r[2] for r in resolved)
+        # Subclasses overriding a phase keep going through it.
+        owner._no_exec = owner._hooks[1] is None and cls._exec is Node._exec
+        owner._idle = (owner._hooks == (None, None, None) and
+                       cls._prep is Node._prep and
+                       cls._exec1 is Node._exec1 and
+                       cls._post is Node._post)
+        owner._resumable = (not owner._is_async and
+                            cls._exec1 is Node._exec1 and
+                            cls._run is Node._run)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in _HOOK_NAMES:
+            Node._bind_hooks(self)
+
+    def __delattr__(self, name):
+        super().__delattr__(name)
+        if name in _HOOK_NAMES:
+            Node._bind_hooks(self)
 
     def __init__(self, retry_waits=None):
         if not self._initialized:
@@ -112,65 +669,1021 @@ class Node(_Singleton, BaseNode):
             self._initialized = True
 
     def _prep(self, shared):
-        cfg = dict(**shared["config"])
-        if (hasattr(self, "COMP") and
-            self.COMP in shared["cmpnt"]):
-            cfg |= shared["cmpnt"][self.COMP].get("config", {})
-        if hasattr(self, "prelude"):
-            return self.prelude(shared, **cfg), cfg
+        cfg = _LayeredConfig.of(shared, self._comp)
+        prelude = self._hooks[0]
+        if prelude is not None:
+            return (prelude(self, shared, **_kwargs(self._hook_args[0], cfg)),
+                    cfg)
         return None, cfg
 
+    def _dispatch_key(self, prelude_res, kwargs):
+        try:
+            return _stable_digest(self.__class__.__module__,
+                                  self.__class__.__qualname__,
+                                  prelude_res, kwargs)
+        # Unpicklable inputs are simply not memoized or coalesced.
+        # pylint: disable=W0718
+        except Exception:
+            return None
+
     def _exec(self, prep_res):
         prelude_res, cfg = prep_res
-        if hasattr(self, "dispatch"):
-            return self.dispatch(prelude_res, **cfg)
+        kwargs = _kwargs(self._hook_args[1], cfg)
+        memo, flight = self._memo, self._flight
+        if memo is None and flight is None:
+            return self._hooks[1](self, prelude_res, **kwargs)
+        key = self._dispatch_key(prelude_res, kwargs)
+        if key is None:
+            return self._hooks[1](self, prelude_res, **kwargs)
+        if memo is not None:
+            hit, res = memo.lookup(key)
+            if hit:
+                return res
+        if flight is None:
+            res = self._hooks[1](self, prelude_res, **kwargs)
         else:
-            return None
+            res = flight.do(key, functools.partial(
+                self._hooks[1], self, prelude_res, **kwargs))
+        if memo is None:
+            return res
+        if inspect.isawaitable(res):
+            return self._store_async(memo, key, res)
+        memo.store(key, res)
+        return res
+
+    @staticmethod
+    async def _store_async(memo, key, awaitable):
+        res = await awaitable
+        memo.store(key, res)
+        return res
 
     def _post(self, shared, prep_res, exec_res):
         prelude_res, cfg = prep_res
-
-        if hasattr(self, "postlude"):
-            return self.postlude(shared, prelude_res, exec_res, **cfg)
-        else:
-            return None
+        postlude = self._hooks[2]
+        if postlude is not None:
+            return postlude(self, shared, prelude_res, exec_res,
+                            **_kwargs(self._hook_args[2], cfg))
+        return None
 
     def _exec_fallback(self,
                       prep_res,
                       exc):
         raise exc
 
+    def _try_exec(self, prep_res, waits):
+        """One dispatch attempt.
+
+        Returns ``(True, result)`` once done, or ``(False, wait)`` when
+        the attempt failed and a retry is due after ``wait`` seconds;
+        ``waits`` is consumed as retries are used up.
+        """
+        try:
+            return True, self._exec(prep_res)
+
+        # pylint: disable=W0718
+        except Exception as exp:
+            if waits:
+                wait = waits.pop(0)
+                for o in _active_observers.get():
+                    o.on_retry(self, len(self.retry_waits) - len(waits),
+                               exp, wait)
+                return False, wait
+            return True, self._exec_fallback(prep_res, exp)
+
     def _exec1(self, prep_res):
+        if self._no_exec:
+            return None
+        waits = [i for i in self.retry_waits]
+        while True:
+            done, res = self._try_exec(prep_res, waits)
+            if done:
+                return res
+            time.sleep(res)
+
+    def _run(self, shared):
+        shared["state"] = self._name
+        if self._idle:
+            return None
+        if self._is_async:
+            raise TypeError(f"{self._name} has coroutine hooks, "
+                            "use run_async")
+        return super()._run(shared)
+
+    async def _exec1_async(self, prep_res):
+        if self._no_exec:
+            return None
         waits = [i for i in self.retry_waits]
         while True:
             try:
-                return self._exec(prep_res)
+                if self._batcher is not None:
+                    # Wait for the batch without blocking the event loop.
+                    res = await asyncio.to_thread(self._exec, prep_res)
+                else:
+                    res = self._exec(prep_res)
+                if inspect.isawaitable(res):
+                    res = await res
+                return res
 
             # pylint: disable=W0718
             except Exception as exp:
                 if waits:
-                    w = waits.pop(0)
-                    time.sleep(w)
+                    await asyncio.sleep(waits.pop(0))
                 else:
                     return self._exec_fallback(prep_res, exp)
 
-    def _run(self, shared):
-        shared["state"] = self.__class__.__name__
-        return super()._run(shared)
+    async def _run_async(self, shared):
+        shared["state"] = self._name
+        if self._idle:
+            return None
+        cls = type(self)
+        if not self._is_async and (cls._run is not Node._run or
+                                   cls._exec1 is not Node._exec1 or
+                                   cls._try_exec is not Node._try_exec):
+            # Go through the overridden phases, off the event loop.
+            return await asyncio.to_thread(self._run, shared)
+        prelude_res, cfg = self._prep(shared)
+        if inspect.isawaitable(prelude_res):
+            prelude_res = await prelude_res
+        prep_res = prelude_res, cfg
+        exec_res = await self._exec1_async(prep_res)
+        res = self._post(shared, prep_res, exec_res)
+        if inspect.isawaitable(res):
+            res = await res
+        return res
+
+class FlowObserver:
+    """Base class for observers registered with ``Flow.observe``.
+
+    Callbacks run synchronously in the thread running the node, so they
+    should be quick.  ``phase`` is one of ``"prelude"``, ``"dispatch"``
+    and ``"postlude"``; ``error`` is the exception that ended the run,
+    node or phase, or ``None``.  Observers also see nested flows and
+    the tasks of parallel and map steps run inside an observed flow.
+    """
+
+    def before_run(self, flow, shared):
+        pass
+
+    def after_run(self, flow, shared, result, error):
+        pass
+
+    def before_node(self, node, shared):
+        pass
+
+    def after_node(self, node, shared, action, error):
+        pass
+
+    def before_phase(self, node, phase):
+        pass
+
+    def after_phase(self, node, phase, error):
+        pass
+
+    def on_retry(self, node, attempt, exc, wait):
+        pass
+
+    def on_transition(self, node, action, target):
+        pass
+
+def _observed_phase(observers, node, phase, fn, *args):
+    for o in observers:
+        o.before_phase(node, phase)
+    try:
+        res = fn(*args)
+    except BaseException as exp:
+        for o in observers:
+            o.after_phase(node, phase, exp)
+        raise
+    for o in observers:
+        o.after_phase(node, phase, None)
+    return res
+
+# pylint: disable=W0212
+def _run_observed_node(node, shared, observers):
+    """Run ``node`` like ``node._run``, reporting it to ``observers``."""
+    for o in observers:
+        o.before_node(node, shared)
+    try:
+        if isinstance(node, Node) and node._resumable and not node._idle:
+            shared["state"] = node._name
+            prep_res = _observed_phase(observers, node, "prelude",
+                                       node._prep, shared)
+            exec_res = _observed_phase(observers, node, "dispatch",
+                                       node._exec1, prep_res)
+            action = _observed_phase(observers, node, "postlude",
+                                     node._post, shared, prep_res, exec_res)
+            # Observers see the node's results freed, as after _run.
+            del prep_res, exec_res
+        else:
+            action = node._run(shared)
+    except BaseException as exp:
+        for o in observers:
+            o.after_node(node, shared, None, exp)
+        raise
+    for o in observers:
+        o.after_node(node, shared, action, None)
+    return action
+
+def _run_task(task, shared):
+    """Run a ParallelStep or MapStep task, observed if its step is."""
+    observers = _active_observers.get()
+    if not observers or isinstance(task, Flow):
+        return task.run(shared=shared)
+    return _run_observed_node(task, shared, observers)
+
+class ProfileObserver(FlowObserver):
+    """Records per-node wall and CPU time, retries and transitions.
+
+    Each thread updates counters of its own; ``snapshot`` merges them
+    on demand into ``{"nodes": {name: {"count", "wall", "cpu"}},
+    "retries": {name: n}, "transitions": {(name, action, target): n}}``.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _counters(self):
+        counters = getattr(self._local, "counters", None)
+        if counters is None:
+            counters = self._local.counters = ({}, {}, {}, [])
+            with self._lock:
+                self._threads.append(counters)
+        return counters
+
+    def before_node(self, node, shared):
+        self._counters()[3].append((time.perf_counter(), time.thread_time()))
+
+    def after_node(self, node, shared, action, error):
+        nodes, _, _, starts = self._counters()
+        wall, cpu = starts.pop()
+        entry = nodes.get(node.__class__.__name__)
+        if entry is None:
+            entry = nodes[node.__class__.__name__] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - wall
+        entry[2] += time.thread_time() - cpu
+
+    def on_retry(self, node, attempt, exc, wait):
+        retries = self._counters()[1]
+        name = node.__class__.__name__
+        retries[name] = retries.get(name, 0) + 1
+
+    def on_transition(self, node, action, target):
+        transitions = self._counters()[2]
+        key = (node.__class__.__name__,
+               action if isinstance(action, str) or action is None
+               else repr(action),
+               None if target is None else target.__class__.__name__)
+        transitions[key] = transitions.get(key, 0) + 1
+
+    def snapshot(self):
+        nodes, retries, transitions = {}, {}, {}
+        with self._lock:
+            threads = list(self._threads)
+        for t_nodes, t_retries, t_transitions, _ in threads:
+            for name, (count, wall, cpu) in list(t_nodes.items()):
+                entry = nodes.setdefault(name, {"count": 0, "wall": 0.0,
+                                                "cpu": 0.0})
+                entry["count"] += count
+                entry["wall"] += wall
+                entry["cpu"] += cpu
+            for name, n in list(t_retries.items()):
+                retries[name] = retries.get(name, 0) + n
+            for key, n in list(t_transitions.items()):
+                transitions[key] = transitions.get(key, 0) + n
+        return {"nodes": nodes, "retries": retries,
+                "transitions": transitions}
+
+    def reset(self):
+        with self._lock:
+            for counters in self._threads:
+                for d in counters[:3]:
+                    d.clear()
+
+class LatencyHistogram:
+    """HDR-style histogram of durations, in seconds.
+
+    Durations are bucketed by nanoseconds on a log-linear scale: exact
+    below ``2 ** precision`` ns, and with ``2 ** (precision - 1)``
+    buckets per power of two above, so quantiles are within a relative
+    error of ``2 ** (1 - precision)`` (about 3% for the default 6).
+    """
+
+    def __init__(self, precision=6):
+        self.precision = precision
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        ns = int(seconds * 1e9)
+        shift = ns.bit_length() - self.precision
+        key = ns if shift <= 0 else (ns >> shift) << shift
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for key, n in list(other.buckets.items()):
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.count += other.count
+        self.total += other.total
+        for bound, pick in (("min", min), ("max", max)):
+            theirs = getattr(other, bound)
+            if theirs is not None:
+                mine = getattr(self, bound)
+                setattr(self, bound,
+                        theirs if mine is None else pick(mine, theirs))
+        return self
+
+    def percentile(self, pct):
+        """The duration below which ``pct`` percent of records fall."""
+        if not self.count:
+            return None
+        rank, seen = pct / 100 * self.count, 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                width = 1 << max(0, key.bit_length() - self.precision)
+                value = (key + (width - 1) / 2) / 1e9
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.min, "max": self.max,
+                **{f"p{p}": self.percentile(p) for p in (50, 90, 99, 99.9)}}
+
+class StatsObserver(FlowObserver):
+    """Latency histograms per node class and phase, and action counts.
+
+    Phases are ``"node"`` (the whole node), ``"prelude"``,
+    ``"dispatch"`` (including retries), ``"postlude"`` and
+    ``"retry_wait"`` (the retry waits taken).  Each thread records into
+    histograms of its own; ``snapshot`` merges them on demand into
+    ``{"nodes": {name: {phase: LatencyHistogram}},
+    "transitions": {(name, action): n}}``.
+    """
+
+    def __init__(self, precision=6):
+        self.precision = precision
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _state(self):
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = self._local.state = ({}, {}, [])
+            with self._lock:
+                self._threads.append(state)
+        return state
+
+    def _record(self, hists, node, phase, seconds):
+        key = (node.__class__.__name__, phase)
+        hist = hists.get(key)
+        if hist is None:
+            hist = hists[key] = LatencyHistogram(self.precision)
+        hist.record(seconds)
+
+    def before_node(self, node, shared):
+        self._state()[2].append(time.perf_counter())
+
+    def after_node(self, node, shared, action, error):
+        hists, _, starts = self._state()
+        self._record(hists, node, "node", time.perf_counter() - starts.pop())
+
+    def before_phase(self, node, phase):
+        self._state()[2].append(time.perf_counter())
+
+    def after_phase(self, node, phase, error):
+        hists, _, starts = self._state()
+        self._record(hists, node, phase, time.perf_counter() - starts.pop())
+
+    def on_retry(self, node, attempt, exc, wait):
+        self._record(self._state()[0], node, "retry_wait", wait)
+
+    def on_transition(self, node, action, target):
+        transitions = self._state()[1]
+        key = (node.__class__.__name__,
+               action if isinstance(action, str) or action is None
+               else repr(action))
+        transitions[key] = transitions.get(key, 0) + 1
+
+    def snapshot(self):
+        nodes, transitions = {}, {}
+        with self._lock:
+            threads = list(self._threads)
+        for hists, t_transitions, _ in threads:
+            for (name, phase), hist in list(hists.items()):
+                phases = nodes.setdefault(name, {})
+                if phase not in phases:
+                    phases[phase] = LatencyHistogram(self.precision)
+                phases[phase].merge(hist)
+            for key, n in list(t_transitions.items()):
+                transitions[key] = transitions.get(key, 0) + n
+        return {"nodes": nodes, "transitions": transitions}
+
+    def reset(self):
+        with self._lock:
+            for hists, transitions, _ in self._threads:
+                hists.clear()
+                transitions.clear()
+
+class JsonLinesExporter:
+    """Appends finished spans to ``path``, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # pylint: disable=R1732
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span):
+        line = json.dumps(span, default=repr) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class ChromeTraceExporter:
+    """Collects spans and writes them to ``path`` on ``close`` in the
+    Chrome trace-event format (``chrome://tracing``, Perfetto)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._events = []
+
+    def export(self, span):
+        start = span["start"] * 1e6
+        args = {k: span[k] for k in ("trace_id", "span_id", "parent_id",
+                                     "error") if span.get(k) is not None}
+        events = [{"name": span["name"], "cat": span["kind"], "ph": "X",
+                   "ts": start, "dur": span["end"] * 1e6 - start,
+                   "pid": os.getpid(), "tid": span["thread"],
+                   "args": {**args, **span["attrs"]}}]
+        for event in span["events"]:
+            fields = {k: v for k, v in event.items()
+                      if k not in ("name", "time")}
+            events.append({"name": event["name"], "cat": span["kind"],
+                           "ph": "i", "s": "t", "ts": event["time"] * 1e6,
+                           "pid": os.getpid(), "tid": span["thread"],
+                           "args": fields})
+        with self._lock:
+            self._events.extend(events)
+
+    def close(self):
+        with self._lock:
+            events, self._events = self._events, []
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events}, f, default=repr)
+
+class Tracer(FlowObserver):
+    """Records each flow run as a tree of spans.
+
+    A run gets a root ``"flow"`` span with a child ``"node"`` span per
+    node and ``"phase"`` spans below those; retries are events on the
+    dispatch span.  Tasks of parallel and map steps become concurrent
+    children of the step's span, whatever thread they run on, and
+    nested flows are children of the node running them.
+
+    Finished spans are dicts passed to ``exporter.export``; times are
+    epoch seconds.  Only a ``sample_rate`` fraction of top-level runs
+    is traced.
+    """
+
+    def __init__(self, exporter, sample_rate=1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._current = contextvars.ContextVar(
+            f"nethervortex_span_{id(self)}", default=None)
+        self._ids = itertools.count(1)
+        self._epoch = time.time() - time.perf_counter()
+
+    def _open(self, kind, name, attrs):
+        parent = self._current.get()
+        if parent is not None and not parent["sampled"]:
+            return
+        span = {"sampled": True, "kind": kind, "name": name,
+                "trace_id": parent["trace_id"] if parent
+                else os.urandom(8).hex(),
+                "span_id": next(self._ids),
+                "parent_id": parent["span_id"] if parent else None,
+                "thread": threading.get_native_id(),
+                "start": self._epoch + time.perf_counter(),
+                "attrs": attrs, "events": [], "parent": parent}
+        self._current.set(span)
+
+    def _close(self, error):
+        span = self._current.get()
+        if span is None or not span["sampled"]:
+            return
+        self._current.set(span["parent"])
+        span["end"] = self._epoch + time.perf_counter()
+        if error is not None:
+            span["error"] = repr(error)
+        self.exporter.export({k: v for k, v in span.items()
+                              if k not in ("sampled", "parent")})
+
+    def before_run(self, flow, shared):
+        if (self._current.get() is None and
+            random.random() >= self.sample_rate):
+            self._current.set({"sampled": False, "flow": flow})
+            return
+        self._open("flow", flow.__class__.__name__, {})
+
+    def after_run(self, flow, shared, result, error):
+        span = self._current.get()
+        if span is not None and not span["sampled"]:
+            if span["flow"] is flow:
+                self._current.set(None)
+            return
+        self._close(error)
+
+    def before_node(self, node, shared):
+        self._open("node", node.__class__.__name__, {})
+
+    def after_node(self, node, shared, action, error):
+        span = self._current.get()
+        if span is not None and span["sampled"]:
+            span["attrs"]["action"] = (action if isinstance(action, str)
+                                       or action is None else repr(action))
+        self._close(error)
+
+    def before_phase(self, node, phase):
+        self._open("phase", phase, {"node": node.__class__.__name__})
+
+    def after_phase(self, node, phase, error):
+        self._close(error)
+
+    def on_retry(self, node, attempt, exc, wait):
+        span = self._current.get()
+        if span is not None and span["sampled"]:
+            span["events"].append({"name": "retry", "attempt": attempt,
+                                   "error": repr(exc), "wait": wait,
+                                   "time": self._epoch +
+                                   time.perf_counter()})
+
+    def close(self):
+        self.exporter.close()
+
+def critical_path(spans):
+    """The critical path of one traced run, from its ``Tracer`` spans.
+
+    Walking back from the end of each span, the child that finished
+    last is on the path, then the child that finished last before that
+    one started, and so on; time not covered by such children is the
+    span's own.  Phase time counts towards its node.  Returns
+    ``[(name, seconds)]`` in run order, adjacent entries merged, whose
+    seconds add up to the root span's duration.
+    """
+    children, root = {}, None
+    for span in spans:
+        if span["parent_id"] is None:
+            root = span
+        else:
+            children.setdefault(span["parent_id"], []).append(span)
+    if root is None:
+        return []
+    path = []
+
+    def walk(span):
+        name = (span["attrs"]["node"] if span["kind"] == "phase"
+                else span["name"])
+        kids = sorted(children.get(span["span_id"], ()),
+                      key=lambda s: s["end"])
+        cursor, segments = span["end"], []
+        while kids:
+            kid = kids.pop()
+            if kid["end"] <= cursor:
+                segments.append(max(0.0, cursor - kid["end"]))
+                segments.append(kid)
+                cursor = kid["start"]
+        segments.append(max(0.0, cursor - span["start"]))
+        for segment in reversed(segments):
+            if isinstance(segment, dict):
+                walk(segment)
+            elif path and path[-1][0] == name:
+                path[-1] = (name, path[-1][1] + segment)
+            else:
+                path.append((name, segment))
+
+    walk(root)
+    return [(name, seconds) for name, seconds in path if seconds > 0]
+
+class CriticalPathStats:
+    """A ``Tracer`` exporter that aggregates critical paths over runs.
+
+    Spans are buffered per trace until its root span ends; the run's
+    ``critical_path`` is then added to per-name totals.  ``forward``
+    is an optional exporter that receives every span as well.
+    """
+
+    def __init__(self, forward=None, keep_done=1024):
+        self.forward = forward
+        self.runs = 0
+        self.last_path = []
+        self._totals = {}
+        self._traces = {}
+        self._done = OrderedDict()
+        self._keep_done = keep_done
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        if self.forward is not None:
+            self.forward.export(span)
+        trace = span["trace_id"]
+        with self._lock:
+            if trace in self._done:
+                return
+            spans = self._traces.setdefault(trace, [])
+            spans.append(span)
+            if span["parent_id"] is not None:
+                return
+            del self._traces[trace]
+            self._done[trace] = None
+            if len(self._done) > self._keep_done:
+                self._done.popitem(last=False)
+        path = critical_path(spans)
+        with self._lock:
+            self.runs += 1
+            self.last_path = path
+            for name, seconds in path:
+                self._totals[name] = self._totals.get(name, 0.0) + seconds
+
+    def totals(self):
+        """Seconds on the critical path per name, summed over runs."""
+        with self._lock:
+            return dict(self._totals)
+
+    def shares(self):
+        """Each name's share of the total critical-path time, largest
+        first."""
+        totals = self.totals()
+        total = sum(totals.values()) or 1.0
+        return dict(sorted(((name, seconds / total)
+                            for name, seconds in totals.items()),
+                           key=lambda item: -item[1]))
+
+    def reset(self):
+        with self._lock:
+            self.runs = 0
+            self.last_path = []
+            self._totals.clear()
+
+    def close(self):
+        if self.forward is not None:
+            self.forward.close()
+
+class RetryScheduler:
+    """A shared timer that calls functions once their delay expires.
+
+    A single daemon thread sleeps on a heap of deadlines, so flows
+    waiting out a retry backoff do not hold a thread each.
+    """
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @classmethod
+    def default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def call_later(self, delay, fn, *args):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay,
+                                        next(self._seq), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="RetryScheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] - now
+                                    if self._heap else None)
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            # pylint: disable=W0718
+            except Exception:
+                logger.exception("Scheduled call %r failed", fn)
+
+def _follow(table, action, missing=None):
+    """Look up the transition for ``action`` in ``table``."""
+    try:
+        return table.get(action if action else "default", missing)
+    # Unhashable results, such as the lists gathered by a ParallelStep,
+    # take the default transition.
+    except TypeError:
+        return table.get("default", missing)
+
+class _Plan:
+    """A frozen, integer-indexed view of the graph reachable from a
+    start node.
+
+    ``nodes[i]`` is the i-th node, ``runs[i]`` its bound ``_run`` and
+    ``jumps[i]`` maps an action to the index of the successor.  Index
+    ``-1`` means the flow ends.
+    """
+    __slots__ = ("nodes", "runs", "jumps")
+
+    def __init__(self, start):
+        index, nodes = {id(start): 0}, [start]
+        i = 0
+        while i < len(nodes):
+            for target in nodes[i].successors.values():
+                if id(target) not in index:
+                    index[id(target)] = len(nodes)
+                    nodes.append(target)
+            i += 1
+        self.nodes = tuple(nodes)
+        # pylint: disable=W0212
+        self.runs = tuple(n._run for n in nodes)
+        self.jumps = tuple({a: index[id(t)] for a, t in n.successors.items()}
+                           for n in nodes)
+
+
+def _shared_entries(shared):
+    """Pickle ``shared`` per top-level entry and per ``cmpnt``
+    component, keyed by path tuples as in ``_shared_delta``."""
+    entries = {}
+    for key, value in shared.items():
+        if key == "cmpnt" and isinstance(value, dict):
+            entries[(key,)] = pickle.dumps({})
+            for comp, data in value.items():
+                entries[(key, comp)] = pickle.dumps(data)
+        else:
+            entries[(key,)] = pickle.dumps(value)
+    return entries
+
+class _CheckpointEncoder:
+    """Encodes the successive checkpoints of one run.
+
+    Every record carries the entries of ``shared`` that changed since
+    the previous record, found by comparing their pickles; every
+    ``full_every`` records all entries are written instead.
+    """
+
+    def __init__(self, full_every, level):
+        self.full_every, self.level = full_every, level
+        self.prev, self.count = None, 0
+
+    def encode(self, action, shared):
+        """Return ``(full, blob)`` for the state after a node."""
+        entries = _shared_entries(shared)
+        full = self.prev is None or self.count % self.full_every == 0
+        if full:
+            changed, removed = entries, []
+        else:
+            prev = self.prev
+            changed = {p: b for p, b in entries.items() if prev.get(p) != b}
+            removed = [p for p in prev if p not in entries]
+        self.prev, self.count = entries, self.count + 1
+        blob = pickle.dumps((action, changed, removed))
+        return full, zlib.compress(blob, self.level)
+
+    @staticmethod
+    def decode(records):
+        """Replay records, starting with a full snapshot, into
+        ``(action, shared)``."""
+        entries, action = {}, None
+        for record in records:
+            action, changed, removed = pickle.loads(zlib.decompress(record[5]))
+            for path in removed:
+                entries.pop(path, None)
+            entries.update(changed)
+        shared = {}
+        for path in sorted(entries, key=len):
+            value = pickle.loads(entries[path])
+            if len(path) == 1:
+                shared[path[0]] = value
+            else:
+                shared[path[0]][path[1]] = value
+        return action, shared
+
+class CheckpointStore:
+    """Base class for the stores a Flow checkpoints its runs to.
+
+    A record is ``(seq, index, name, done, full, blob)``: the position
+    of the completed node in the flow's plan, its class name, whether
+    the run has finished, and the encoded action and ``shared`` after
+    that node -- a full snapshot when ``full`` is true, otherwise the
+    changes since the previous record.  ``save`` only queues the
+    record; a background thread writes it with ``append`` so the flow
+    does not wait for I/O.  ``flush`` waits until every queued record
+    is written.
+
+    Flows write a full snapshot every ``full_every`` records and
+    compress records with zlib at ``level``.
+    """
+
+    def __init__(self, full_every=50, level=1):
+        self.full_every, self.level = full_every, level
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def append(self, run_id, record):
+        raise NotImplementedError
+
+    def records(self, run_id):
+        """The records of ``run_id``, oldest first."""
+        raise NotImplementedError
+
+    def tail(self, run_id):
+        """The records of ``run_id`` from its last full snapshot on."""
+        records = list(self.records(run_id))
+        for i in range(len(records) - 1, -1, -1):
+            if records[i][4]:
+                return records[i:]
+        return []
+
+    def save(self, run_id, record):
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                threading.Thread(target=self._write, daemon=True,
+                                 name="CheckpointWriter").start()
+        self._queue.put((run_id, record))
+
+    def flush(self):
+        if self._queue is not None:
+            self._queue.join()
+
+    def _write(self):
+        while True:
+            run_id, record = self._queue.get()
+            try:
+                self.append(run_id, record)
+            # pylint: disable=W0718
+            except Exception:
+                logger.exception("Failed to write checkpoint of run '%s'",
+                                 run_id)
+            finally:
+                self._queue.task_done()
+
+class SQLiteCheckpoints(CheckpointStore):
+    """Keeps checkpoints in a SQLite database file."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS checkpoints ("
+                         "run_id TEXT, seq INTEGER, idx INTEGER, name TEXT,"
+                         " done INTEGER, full INTEGER, blob BLOB,"
+                         " PRIMARY KEY (run_id, seq))")
+
+    def _conn(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=30)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.pid = os.getpid()
+        return local.conn
+
+    def append(self, run_id, record):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO checkpoints"
+                         " VALUES (?, ?, ?, ?, ?, ?, ?)", (run_id, *record))
+
+    def _select(self, where, args):
+        with self._conn() as conn:
+            rows = conn.execute("SELECT seq, idx, name, done, full, blob"
+                                " FROM checkpoints WHERE run_id = ?" + where +
+                                " ORDER BY seq", args).fetchall()
+        return [(seq, idx, name, bool(done), bool(full), blob)
+                for seq, idx, name, done, full, blob in rows]
+
+    def records(self, run_id):
+        return self._select("", (run_id,))
+
+    def tail(self, run_id):
+        return self._select(" AND seq >= (SELECT MAX(seq) FROM checkpoints"
+                            " WHERE run_id = ? AND full)", (run_id, run_id))
+
+class FileCheckpoints(CheckpointStore):
+    """Appends checkpoints to one file per run under ``directory``.
+
+    A record cut short by a crash is ignored when reading.
+    """
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, run_id):
+        return os.path.join(self.directory, f"{run_id}.ckpt")
+
+    def append(self, run_id, record):
+        with open(self._path(run_id), "ab") as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def records(self, run_id):
+        records = []
+        try:
+            with open(self._path(run_id), "rb") as f:
+                while True:
+                    records.append(pickle.load(f))
+        except FileNotFoundError:
+            pass
+        except (EOFError, pickle.UnpicklingError):
+            pass
+        return records
+
 
 class Flow(BaseNode):
-    """Flow class is the engine to run the pipeline."""
+    """Flow class is the engine to run the pipeline.
 
-    def __init__(self, start=None):
+    With a ``CheckpointStore`` in ``checkpoints``, ``run(shared,
+    run_id=...)`` records the action and ``shared`` after every node,
+    and ``resume(run_id)`` continues an interrupted run after the last
+    completed node.
+    """
+
+    def __init__(self, start=None, checkpoints=None, stats=False):
         super().__init__()
         self.start_node = start
+        self.checkpoints = checkpoints
+        self._plan = None
+        self._observers = ()
+        self._stats = self.observe(StatsObserver()) if stats else None
+
+    def stats(self, reset=False):
+        """Latency histograms and action counts of the flow's runs.
+
+        Needs a flow created with ``stats=True``; see ``StatsObserver``
+        for the layout.  With ``reset`` the counters start over after
+        the snapshot is taken.
+        """
+        if self._stats is None:
+            raise RuntimeError("Create the Flow with stats=True to "
+                               "collect stats")
+        snapshot = self._stats.snapshot()
+        if reset:
+            self._stats.reset()
+        return snapshot
+
+    def observe(self, observer):
+        """Register a ``FlowObserver`` and return it.
+
+        Observers see ``run`` and ``run_many``, and every flow run inside
+        them.  Runs of flows without observers take the unobserved path
+        unchanged; ``run_async``, ``stream``, ``run_columns`` and
+        checkpointed runs are not observed.
+        """
+        self._observers += (observer,)
+        return observer
+
+    def unobserve(self, observer):
+        self._observers = tuple(o for o in self._observers
+                                if o is not observer)
 
     def start(self, start):
         self.start_node = start
+        self._plan = None
         return start
 
+    def compile(self):
+        """Freeze the graph reachable from ``start_node`` into a plan.
+
+        Subsequent runs walk the plan instead of the ``successors``
+        dicts.  Transitions added after compiling are not seen until
+        ``compile`` is called again.
+        """
+        self._plan = _Plan(self.start_node) if self.start_node else None
+        return self
+
     def get_next_node(self, curr, action):
-        cadr = curr.successors.get(action if action else "default")
+        cadr = _follow(curr.successors, action)
         if not cadr and curr.successors:
             logger.debug(
                 "Flow ends: '%s' not found in %s"
@@ -180,6 +1693,8 @@ class Flow(BaseNode):
         return cadr
 
     def _loop(self, shared):
+        if self._plan is not None:
+            return self._loop_plan(self._plan, shared)
         curr, last_action =self.start_node, None
         while curr:
             logger.debug("run node %s", curr.__class__.__name__)
@@ -195,34 +1710,864 @@ class Flow(BaseNode):
 
         return last_action
 
+    def _loop_plan(self, plan, shared):
+        runs, jumps = plan.runs, plan.jumps
+        if logger.isEnabledFor(logging.DEBUG):
+            names = [n.__class__.__name__ for n in plan.nodes]
+        else:
+            names = None
+        i, last_action = 0, None
+        while i >= 0:
+            if names:
+                logger.debug("run node %s", names[i])
+            last_action = runs[i](shared)
+            if names:
+                logger.debug("node %s result: %s", names[i], last_action)
+            try:
+                i = jumps[i].get(last_action if last_action else "default",
+                                 -1)
+            except TypeError:
+                i = jumps[i].get("default", -1)
+        return last_action
+
+    async def _loop_async(self, shared):
+        plan, last_action = self._plan, None
+        if plan is not None:
+            nodes, jumps, i = plan.nodes, plan.jumps, 0
+            while i >= 0:
+                # pylint: disable=W0212
+                last_action = await nodes[i]._run_async(shared)
+                i = _follow(jumps[i], last_action, -1)
+            return last_action
+        curr = self.start_node
+        while curr:
+            logger.debug("run node %s", curr.__class__.__name__)
+            # pylint: disable=W0212
+            last_action = await curr._run_async(shared)
+            logger.debug(
+                "node %s result: %s",
+                curr.__class__.__name__,
+                last_action
+            )
+            curr = self.get_next_node(curr, last_action)
+        return last_action
+
     def _run(self, shared):
+        observers = _active_observers.get()
+        if self._observers:
+            observers += tuple(o for o in self._observers
+                               if o not in observers)
+        if observers:
+            return self._run_observed(shared, observers)
         # pylint: disable=E1128
         t0 = self._prep(shared)
         t1 = self._loop(shared)
         return self._post(shared, t0, t1)
 
+    def _run_observed(self, shared, observers):
+        token = _active_observers.set(observers)
+        try:
+            for o in observers:
+                o.before_run(self, shared)
+            plan, curr, i, action = self._plan, self.start_node, 0, None
+            t0 = self._prep(shared)
+            while curr:
+                action = _run_observed_node(curr, shared, observers)
+                if plan is not None:
+                    i = _follow(plan.jumps[i], action, -1)
+                    target = plan.nodes[i] if i >= 0 else None
+                else:
+                    target = self.get_next_node(curr, action)
+                for o in observers:
+                    o.on_transition(curr, action, target)
+                curr = target
+            res = self._post(shared, t0, action)
+        except BaseException as exp:
+            for o in observers:
+                o.after_run(self, shared, None, exp)
+            raise
+        finally:
+            _active_observers.reset(token)
+        for o in observers:
+            o.after_run(self, shared, res, None)
+        return res
+
+    async def _run_async(self, shared):
+        # pylint: disable=E1128
+        t0 = self._prep(shared)
+        t1 = await self._loop_async(shared)
+        return self._post(shared, t0, t1)
+
+    def run(self, shared: SharedData, run_id=None):
+        if run_id is None or self.checkpoints is None:
+            return super().run(shared)
+        return self._run_checkpointed(self._plan or _Plan(self.start_node),
+                                      shared, run_id, 0, 0)
+
+    def resume(self, run_id, shared=None):
+        """Continue the checkpointed run ``run_id`` after its last
+        completed node and return its result.
+
+        Nodes that already completed are not run again.  If ``shared``
+        is given it is updated in place with the restored data.
+        """
+        records = self.checkpoints.tail(run_id) if self.checkpoints else []
+        if not records:
+            raise KeyError(f"No checkpoint for run '{run_id}'")
+        seq, index, name, done = records[-1][:4]
+        action, restored = _CheckpointEncoder.decode(records)
+        if shared is not None:
+            shared.clear()
+            shared.update(restored)
+            restored = shared
+        if done:
+            return action
+        plan = self._plan or _Plan(self.start_node)
+        if (index >= len(plan.nodes) or
+            plan.nodes[index].__class__.__name__ != name):
+            raise ValueError(f"Run '{run_id}' stopped at {name}, which is "
+                             "no longer at that place in the flow")
+        return self._run_checkpointed(plan, restored, run_id,
+                                      _follow(plan.jumps[index], action, -1),
+                                      seq + 1, action)
+
+    # pylint: disable=R0913
+    def _run_checkpointed(self, plan, shared, run_id, i, seq,
+                          last_action=None):
+        store = self.checkpoints
+        encoder = _CheckpointEncoder(store.full_every, store.level)
+        try:
+            t0 = self._prep(shared)
+            while i >= 0:
+                last_action = plan.runs[i](shared)
+                store.save(run_id, (seq, i, plan.nodes[i].__class__.__name__,
+                                    False,
+                                    *encoder.encode(last_action, shared)))
+                seq += 1
+                i = _follow(plan.jumps[i], last_action, -1)
+            res = self._post(shared, t0, last_action)
+            store.save(run_id, (seq, -1, "", True,
+                                *encoder.encode(res, shared)))
+            return res
+        finally:
+            store.flush()
+
+    def run_many(self, inputs, concurrency=4, *, ordered=True,
+                 return_exceptions=False, max_pending=None, scheduler=None):
+        """Run the flow over an iterable of ``SharedData``.
+
+        Inputs are pulled lazily and run on a pool of ``concurrency``
+        threads, with at most ``max_pending`` (default
+        ``2 * concurrency``) of them in flight.  A node waiting out a
+        positive retry wait does not hold a worker: its run is parked on
+        ``scheduler`` (default ``RetryScheduler.default()``) and resumed
+        at the same node when the backoff expires.
+
+        Yields ``(shared, result)`` pairs, in input order when
+        ``ordered`` is true and as they complete otherwise.  An input
+        that raises stops the batch, unless ``return_exceptions`` is
+        true, in which case the exception is yielded as its result.
+        The graph is compiled once for the whole batch.  Observed runs
+        hold their worker through retry waits.
+        """
+        plan = self._plan
+        if plan is None and self.start_node:
+            plan = _Plan(self.start_node)
+        scheduler = scheduler or RetryScheduler.default()
+        max_pending = max_pending or 2 * concurrency
+        inputs = iter(inputs)
+        pending, owner = deque(), {}
+        executor = ThreadPoolExecutor(max_workers=concurrency,
+                                      thread_name_prefix="run_many")
+        observed = bool(self._observers or _active_observers.get())
+
+        def fill():
+            while len(pending) < max_pending:
+                shared = next(inputs, None)
+                if shared is None:
+                    return
+                if observed:
+                    fut = executor.submit(contextvars.copy_context().run,
+                                          self._run, shared)
+                else:
+                    run = _FlowRun(self, plan, shared, executor.submit,
+                                   scheduler)
+                    fut = run.future
+                    executor.submit(run.step)
+                owner[fut] = shared
+                pending.append(fut)
+
+        def outcome(fut):
+            shared = owner.pop(fut)
+            try:
+                return shared, fut.result()
+            except Exception as exp: # pylint: disable=W0718
+                if not return_exceptions:
+                    raise
+                return shared, exp
+
+        try:
+            fill()
+            while pending:
+                if ordered:
+                    fut = pending.popleft()
+                else:
+                    done, _ = _wait_futures(pending,
+                                            return_when=FIRST_COMPLETED)
+                    fut = done.pop()
+                    pending.remove(fut)
+                yield outcome(fut)
+                fill()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def run_columns(self, shared, columns):
+        """Run the flow over a batch of records given column-wise.
+
+        ``columns`` maps column names to equally long sequences; they
+        become NumPy arrays when NumPy is installed and lists otherwise.
+        Each node runs once per sub-batch of records that reached it,
+        with the sub-batch's columns in ``shared["columns"]`` (nodes may
+        add or replace columns there).  Other top-level keys a node sets
+        on ``shared`` reach its successors; a split sub-batch carries a
+        shallow copy of them.  A node returns either one action
+        for the whole sub-batch or a sequence of per-record actions;
+        records are then split by action with masks and routed in bulk
+        to the matching successors.
+
+        Returns ``(actions, columns)``: the last action of every record
+        and the final columns, in the original record order.
+        """
+        columns = {k: self._column(v) for k, v in columns.items()}
+        lengths = {k: len(v) for k, v in columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError("run_columns needs equally long columns, got "
+                             f"lengths {lengths}")
+        n = len(next(iter(columns.values()))) if columns else 0
+        actions = self._column([None] * n, object)
+        out = {}
+        plan = self._plan
+        if plan is None and self.start_node:
+            plan = _Plan(self.start_node)
+        if not plan or not n:
+            return actions, columns
+        work = [(0, self._column(range(n), int),
+                 {**shared, "columns": columns})]
+        while work:
+            i, rows, sub = work.pop()
+            # pylint: disable=W0212
+            action = plan.nodes[i]._run(sub)
+            cols = {k: self._column(v) for k, v in sub["columns"].items()}
+            for act, pos in self._split(action, len(rows)):
+                j = _follow(plan.jumps[i], act, -1)
+                if pos is not None:
+                    part = {k: _take(v, pos) for k, v in cols.items()}
+                    part_rows = _take(rows, pos)
+                    # Each split gets its own top level, so keys written
+                    # further down one branch do not leak into another.
+                    part_shared = {**sub, "columns": part}
+                else:
+                    part, part_rows = cols, rows
+                    sub["columns"] = part
+                    part_shared = sub
+                if j >= 0:
+                    work.append((j, part_rows, part_shared))
+                    continue
+                for r in part_rows:
+                    actions[r] = act
+                for k, v in part.items():
+                    out.setdefault(k, []).append((part_rows, v))
+        return actions, {k: self._gather(parts, n) for k, parts in out.items()}
+
+    @staticmethod
+    def _column(values, dtype=None):
+        np = _numpy()
+        if np is None:
+            return list(values)
+        return np.asarray(list(values) if isinstance(values, range)
+                          else values, dtype=dtype)
+
+    @staticmethod
+    def _gather(parts, n):
+        """Reassemble ``(rows, values)`` parts of a column in record
+        order; records without a value get ``None``."""
+        np = _numpy()
+        if np is None:
+            col = [None] * n
+            for rows, values in parts:
+                for r, v in zip(rows, values):
+                    col[r] = v
+            return col
+        rows = np.concatenate([r for r, _ in parts])
+        values = np.concatenate([v for _, v in parts])
+        if len(rows) == n:
+            col = np.empty_like(values)
+        else:
+            col = np.full(n, None, dtype=object)
+        col[rows] = values
+        return col
+
+    @staticmethod
+    def _split(action, n):
+        """``(action, positions)`` groups of a node result; positions
+        are ``None`` when the whole sub-batch takes one action."""
+        np = _numpy()
+        per_record = (isinstance(action, (list, tuple)) or
+                      (np is not None and isinstance(action, np.ndarray)))
+        if not per_record or len(action) != n:
+            return [(action, None)]
+        if np is not None:
+            action = np.asarray(action, dtype=object)
+            return [(a, np.flatnonzero(action == a))
+                    for a in dict.fromkeys(action.tolist())]
+        groups = {}
+        for pos, a in enumerate(action):
+            groups.setdefault(a, []).append(pos)
+        return list(groups.items())
+
+    def _stages(self):
+        """The nodes of a linear flow, in order."""
+        nodes, curr = [], self.start_node
+        while curr:
+            if any(curr is n for n in nodes):
+                raise ValueError("stream needs an acyclic flow")
+            if set(curr.successors) - {"default"}:
+                raise ValueError(
+                    f"stream needs a linear flow, {curr.__class__.__name__}"
+                    f" branches on {list(curr.successors)}")
+            nodes.append(curr)
+            curr = curr.successors.get("default")
+        return nodes
+
+    def stream(self, inputs, workers=1, maxsize=4):
+        """Run a linear flow over an iterable of ``SharedData`` as a
+        pipeline.
+
+        Every node becomes a stage with ``workers`` threads, connected
+        to the next stage by a queue of at most ``maxsize`` items, so
+        input k+1 can be in one node while input k is in the next one.
+        A full queue blocks the stage feeding it.  An input whose
+        action does not lead on to the next node skips the remaining
+        stages.  Yields ``(shared, result)`` pairs in input order; an
+        input that raises stops the stream.
+        """
+        stages = self._stages()
+        queues = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+        stop = threading.Event()
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return None
+
+        def feed():
+            try:
+                for seq, shared in enumerate(inputs):
+                    put(queues[0], [seq, shared, self._prep(shared), None,
+                                    False, None])
+            # pylint: disable=W0718
+            except Exception as exp:
+                put(queues[0], [-1, None, None, None, True, exp])
+            for _ in range(workers):
+                put(queues[0], None)
+
+        def work(k, node, exited):
+            inq, outq = queues[k], queues[k + 1]
+            while True:
+                item = get(inq)
+                if item is None:
+                    break
+                if not item[4]:
+                    try:
+                        # pylint: disable=W0212
+                        item[3] = node._run(item[1])
+                        item[4] = _follow(node.successors, item[3]) is None
+                    # pylint: disable=W0718
+                    except Exception as exp:
+                        item[4], item[5] = True, exp
+                put(outq, item)
+            with exited[1]:
+                exited[0] += 1
+                if exited[0] == workers:
+                    for _ in range(workers):
+                        put(outq, None)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for k, node in enumerate(stages):
+            exited = [0, threading.Lock()]
+            threads.extend(threading.Thread(target=work, args=(k, node, exited),
+                                            daemon=True,
+                                            name=f"stream-{k}-{w}")
+                           for w in range(workers))
+        for t in threads:
+            t.start()
+
+        out, ready, nxt, ended = queues[-1], {}, 0, 0
+        try:
+            while ended < workers:
+                item = out.get()
+                if item is None:
+                    ended += 1
+                    continue
+                if item[0] < 0:
+                    raise item[5]
+                ready[item[0]] = item
+                while nxt in ready:
+                    seq, shared, t0, action, _, error = ready.pop(nxt)
+                    if error is not None:
+                        raise error
+                    yield shared, self._post(shared, t0, action)
+                    nxt = seq + 1
+        finally:
+            stop.set()
+
     def _post(self, shared, prep_res, exec_res):
         return exec_res
 
 
+def _take(col, pos):
+    np = _numpy()
+    if np is not None and isinstance(col, np.ndarray):
+        return col[pos]
+    return [col[p] for p in pos]
+
+
+class _FlowRun:
+    """One run of a compiled flow that can give its thread back while a
+    node backs off before a retry.
+
+    Resumable nodes have their phases driven here instead of in
+    ``Node._run``: when a dispatch attempt fails with a positive retry
+    wait, the run is parked on the ``RetryScheduler`` and later resumed
+    on any worker thread, at the same node with the same prep result.
+    Other nodes (flows, parallel steps, nodes with custom phases) run
+    as usual and back off in place.
+    """
+
+    def __init__(self, flow, plan, shared, submit, scheduler):
+        self.flow, self.plan, self.shared = flow, plan, shared
+        self.submit, self.scheduler = submit, scheduler
+        self.future = Future()
+        self.i, self.last_action = -1 if plan is None else 0, None
+        self.t0 = self.resume = None
+        self.started = False
+
+    def step(self):
+        try:
+            delay = self._advance()
+        except BaseException as exp: # pylint: disable=W0718
+            self.future.set_exception(exp)
+            return
+        if delay is None:
+            return
+        self.scheduler.call_later(delay, self._resubmit)
+
+    def _resubmit(self):
+        try:
+            self.submit(self.step)
+        except RuntimeError as exp:
+            # The executor was shut down while the run was parked.
+            self.future.set_exception(exp)
+
+    # pylint: disable=W0212
+    def _advance(self):
+        shared = self.shared
+        if not self.started:
+            self.started = True
+            self.t0 = self.flow._prep(shared)
+        while self.i >= 0:
+            node = self.plan.nodes[self.i]
+            if (isinstance(node, Node) and node._resumable and
+                not node._idle):
+                if self.resume is None:
+                    shared["state"] = node._name
+                    prep_res = node._prep(shared)
+                    waits = [w for w in node.retry_waits]
+                else:
+                    prep_res, waits = self.resume
+                    self.resume = None
+                exec_res = None
+                while not node._no_exec:
+                    done, exec_res = node._try_exec(prep_res, waits)
+                    if done:
+                        break
+                    if exec_res > 0:
+                        self.resume = prep_res, waits
+                        return exec_res
+                action = node._post(shared, prep_res, exec_res)
+            else:
+                action = node._run(shared)
+            self.last_action = action
+            self.i = _follow(self.plan.jumps[self.i], action, -1)
+        self.future.set_result(self.flow._post(shared, self.t0,
+                                               self.last_action))
+        return None
+
+
+def _unchanged(a, b):
+    try:
+        return bool(a == b)
+    # Elementwise __eq__ (arrays) or incomparable values.
+    # pylint: disable=W0718
+    except Exception:
+        return pickle.dumps(a) == pickle.dumps(b)
+
+def _shared_delta(before, after):
+    """The top-level entries of ``after`` and of its ``cmpnt`` that
+    differ from ``before``, as ``(changed, removed)`` keyed by path
+    tuples such as ``("state",)`` or ``("cmpnt", "D")``.
+    """
+    changed, removed = {}, []
+    b_cmpnt = before.get("cmpnt")
+    for key, value in after.items():
+        if (key == "cmpnt" and isinstance(value, dict) and
+            isinstance(b_cmpnt, dict)):
+            for comp, data in value.items():
+                if comp not in b_cmpnt or not _unchanged(b_cmpnt[comp], data):
+                    changed[("cmpnt", comp)] = data
+            removed.extend(("cmpnt", c) for c in b_cmpnt if c not in value)
+        elif key not in before or not _unchanged(before[key], value):
+            changed[(key,)] = value
+    removed.extend((k,) for k in before if k not in after)
+    return changed, removed
+
+def _apply_delta(shared, delta):
+    changed, removed = delta
+    for path, value in changed.items():
+        if len(path) == 1:
+            shared[path[0]] = value
+        else:
+            shared.setdefault(path[0], {})[path[1]] = value
+    for path in removed:
+        if len(path) == 1:
+            shared.pop(path[0], None)
+        else:
+            shared.get(path[0], {}).pop(path[1], None)
+
+def _picklable_view(shared):
+    """A shallow copy of ``shared`` without the top-level entries (and
+    ``cmpnt`` components) that cannot be pickled."""
+    def ok(path, value):
+        try:
+            pickle.dumps(value)
+            return True
+        # pylint: disable=W0718
+        except Exception:
+            logger.warning("Not shipping unpicklable shared%s to worker",
+                           "".join(f"[{p!r}]" for p in path))
+            return False
+    view = {}
+    for key, value in shared.items():
+        if key == "cmpnt" and isinstance(value, dict):
+            view[key] = {c: d for c, d in value.items()
+                         if ok((key, c), d)}
+        elif ok((key,), value):
+            view[key] = value
+    return view
+
+def _run_pickled(payload):
+    """Process-pool entry: run a ``(task, shared)`` pair pickled
+    separately and return its result with the changes it made to
+    ``shared``."""
+    task_data, shared_data = payload
+    task, shared = pickle.loads(task_data), pickle.loads(shared_data)
+    # Only the shared part is unpickled again, to diff against.
+    before = pickle.loads(shared_data)
+    result = task.run(shared=shared)
+    return result, _shared_delta(before, shared)
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _process_executor():
+    """The process pool shared by process-backed steps."""
+    global _process_pool # pylint: disable=W0603
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor()
+        return _process_pool
+
+
+def _run_chunk(task, shared, item_key, items):
+    """Run ``task`` once per item, each on its own shallow copy of
+    ``shared`` holding the item under ``item_key``."""
+    return [_run_task(task, {**shared, item_key: item}) for item in items]
+
+def _run_pickled_chunk(payload):
+    return _run_chunk(*pickle.loads(payload))
+
+class MapStep(BaseNode):
+    """The MapStep runs one node or flow over every item of a collection.
+
+    ``source`` is a key of ``shared`` or a callable ``source(shared)``
+    returning the items.  Items are split into chunks of ``chunk_size``
+    and the chunks run on a bounded pool: ``max_workers`` threads of
+    the step's own, or worker processes with ``backend="process"``
+    (``executor`` overrides either).  Each item run sees a shallow copy
+    of ``shared`` holding the item under ``shared[item_key]``; process
+    runs only send their results back.
+
+    The step returns the results in item order and, when ``target`` is
+    given, also stores them in ``shared[target]``.
+    """
+
+    BACKENDS = ("thread", "process")
+
+    # pylint: disable=R0913
+    def __init__(self, task, source, *, item_key="item", target=None,
+                 chunk_size=1, max_workers=None, backend="thread",
+                 executor=None):
+        super().__init__()
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown MapStep backend '{backend}'")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.task, self.source = task, source
+        self.item_key, self.target = item_key, target
+        self.chunk_size, self.max_workers = chunk_size, max_workers
+        self.backend = backend
+        self._executor = executor
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                if self.backend == "process":
+                    return _process_executor()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="MapStep")
+            return self._executor
+
+    def _prep(self, shared):
+        items = (self.source(shared) if callable(self.source)
+                 else shared[self.source])
+        items = list(items)
+        size = self.chunk_size
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _post(self, shared, prep_res, exec_res):
+        executor = self._pool()
+        if self.backend == "process":
+            view = _picklable_view(shared)
+            futures = [executor.submit(_run_pickled_chunk, pickle.dumps(
+                (self.task, view, self.item_key, chunk)))
+                       for chunk in prep_res]
+        elif _active_observers.get():
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       _run_chunk, self.task, shared,
+                                       self.item_key, chunk)
+                       for chunk in prep_res]
+        else:
+            futures = [executor.submit(_run_chunk, self.task, shared,
+                                       self.item_key, chunk)
+                       for chunk in prep_res]
+        try:
+            results = [r for f in futures for r in f.result()]
+        finally:
+            for f in futures:
+                f.cancel()
+        if self.target is not None:
+            shared[self.target] = results
+        return results
+
+
+class _Gather:
+    """Collects task outcomes for a ParallelStep in completion order.
+
+    ``add`` returns true once no further outcome can change the result,
+    so the caller may stop waiting and cancel the remaining tasks.
+    """
+
+    def __init__(self, step):
+        self.step, self.n = step, len(step._tasks) # pylint: disable=W0212
+        self.need = {"first_completed": 1,
+                     "quorum": step.quorum}.get(step.collect, self.n)
+        if step.collect == "quorum" and self.need > self.n:
+            raise ValueError(f"quorum {self.need} exceeds the "
+                             f"{self.n} tasks of the ParallelStep")
+        self.results, self.errors = {}, []
+
+    def add(self, index, ok, value):
+        if ok:
+            self.results[index] = value
+        else:
+            self.errors.append(value)
+        return (len(self.results) >= self.need or
+                self.n - len(self.errors) < self.need)
+
+    def result(self):
+        if len(self.results) < self.need or (
+                self.errors and self.need == self.n):
+            if self.errors:
+                raise self.errors[0]
+            raise RuntimeError(f"ParallelStep got {len(self.results)} of "
+                               f"the {self.need} results it needs")
+        collect, results = self.step.collect, self.results
+        if collect in ("first_completed", "quorum"):
+            winners = list(results.values())[:self.need]
+            return winners[0] if collect == "first_completed" else winners
+        ordered = [results[i] for i in range(self.n)]
+        if collect == "all":
+            return ordered
+        if collect == "reduce":
+            return self.step.reducer(ordered)
+        return ordered[0]
+
+
 try:
     import pykka
 
     class PSlot(pykka.ThreadingActor):
-        def __init__(self, shared):
-            super().__init__()
-            self._shared = shared
+        """A reusable worker that runs ``(flow, shared, reply, ctx)`` messages.
+
+        ``reply`` is called with ``(True, result)`` or ``(False, exc)``.
+        ``ctx`` is the ``contextvars.Context`` to run an observed task
+        in, or ``None``.
+        """
+        use_daemon_thread = True
 
-        def on_receive(self, flow):
-            return flow.run(shared=self._shared)
+        def on_receive(self, message):
+            flow, shared, reply, ctx = message
+            try:
+                if ctx is None:
+                    outcome = True, flow.run(shared=shared)
+                else:
+                    outcome = True, ctx.run(_run_task, flow, shared)
+            # pylint: disable=W0718
+            except Exception as exp:
+                outcome = False, exp
+            reply(*outcome)
+
+    class PSlotPool:
+        """A bounded pool of PSlot actors, shared by ParallelSteps.
+
+        At most ``size`` actors are started, lazily, and kept for
+        reuse.  When all of them are busy ``acquire`` returns ``None``
+        and the ParallelStep runs the task in its own thread instead,
+        so the number of threads stays bounded and nested ParallelSteps
+        never wait for an actor held by their caller.
+        """
+        _default = None
+        _default_lock = threading.Lock()
+
+        def __init__(self, size=8):
+            self.size = size
+            self._idle = []
+            self._started = 0
+            self._lock = threading.Lock()
+
+        @classmethod
+        def default(cls, size=None):
+            """The pool used by ParallelSteps created without one."""
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+                if size is not None:
+                    cls._default.size = size
+                return cls._default
+
+        def acquire(self):
+            """An idle actor, a new one while fewer than ``size`` are
+            running, or ``None`` when the pool is saturated."""
+            with self._lock:
+                if self._idle:
+                    return self._idle.pop()
+                if self._started >= self.size:
+                    return None
+                self._started += 1
+            try:
+                return PSlot.start()
+            except BaseException:
+                with self._lock:
+                    self._started -= 1
+                raise
+
+        def release(self, slot):
+            with self._lock:
+                if self._started <= self.size:
+                    self._idle.append(slot)
+                    return
+                # The pool was shrunk since this actor started.
+                self._started -= 1
+            slot.stop(block=False)
+
+        def shutdown(self):
+            with self._lock:
+                idle, self._idle = self._idle, []
+                self._started -= len(idle)
+            for slot in idle:
+                slot.stop()
 
     class ParallelStep(BaseNode):
         """The ParallelStep run the nodes in threads via actors.
+
+        With the default ``backend="thread"`` actors are borrowed from
+        ``pool`` (by default the shared ``PSlotPool.default()``) and
+        returned once their task is done; tasks finding the pool busy
+        run in the calling thread.  With ``backend="process"``
+        each task is pickled together with a picklable view of
+        ``shared`` and run on ``executor`` (by default a process pool
+        shared by all steps); the changes finished tasks made to the
+        top-level entries of ``shared`` and of ``shared["cmpnt"]`` are
+        merged back in task order.
+
+        ``collect`` decides what the step returns:
+
+        * ``"first"``: the result of the first task (the default);
+        * ``"all"``: the list of all results, in task order;
+        * ``"reduce"``: ``reducer(list_of_results)``;
+        * ``"first_completed"``: the result of the first task to
+          succeed, without waiting for the others;
+        * ``"quorum"``: the first ``quorum`` successful results, in
+          completion order.
+
+        Tasks that are no longer needed are cancelled where the backend
+        allows it; running threads are left to finish in the background.
         """
 
-        def __init__(self):
+        BACKENDS = ("thread", "process")
+        COLLECT = ("first", "all", "reduce", "first_completed", "quorum")
+
+        # pylint: disable=R0913
+        def __init__(self, pool=None, *, backend="thread", executor=None,
+                     collect="first", reducer=None, quorum=None):
             super().__init__()
+            if backend not in self.BACKENDS:
+                raise ValueError(f"Unknown ParallelStep backend '{backend}'")
+            if collect not in self.COLLECT:
+                raise ValueError(f"Unknown ParallelStep collect '{collect}'")
+            if collect == "reduce" and reducer is None:
+                raise ValueError("collect='reduce' needs a reducer")
+            if collect == "quorum" and (not isinstance(quorum, int) or
+                                        quorum < 1):
+                raise ValueError("collect='quorum' needs a quorum of at "
+                                 "least 1")
             self._tasks = ()
+            self._pool = pool
+            self.backend = backend
+            self._executor = executor
+            self.collect, self.reducer, self.quorum = collect, reducer, quorum
 
         def __getitem__(self, tasks):
             if (isinstance(tasks, Node) or
@@ -230,19 +2575,426 @@ try:
                 self._tasks = (tasks,)
             else:
                 self._tasks = tuple(x for x in tasks)
+            if self.collect == "quorum" and self.quorum > len(self._tasks):
+                raise ValueError(f"quorum {self.quorum} exceeds the "
+                                 f"{len(self._tasks)} tasks given")
             return self
 
-        def _prep(self, shared):
-            return [PSlot.start(shared) for _ in self._tasks]
+        def __getstate__(self):
+            state = self.__dict__.copy()
+            state["_pool"] = state["_executor"] = None
+            return state
 
         def _post(self, shared, prep_res, exec_res):
-            futures = [p.ask(f, block=False)
-                       for (p, f) in zip(prep_res, self._tasks)]
-            results = [f.get() for f in futures]
+            if self.backend == "process":
+                return self._run_processes(shared)
+            pool = self._pool or PSlotPool.default()
+            done = queue.SimpleQueue()
+
+            def reply(index, slot, ok, value):
+                pool.release(slot)
+                done.put((index, ok, value))
+
+            gather = _Gather(self)
+            observed = bool(_active_observers.get())
+            pending, finished = 0, False
+            for i, task in enumerate(self._tasks):
+                slot = pool.acquire()
+                if slot is not None:
+                    ctx = contextvars.copy_context() if observed else None
+                    slot.tell((task, shared,
+                               functools.partial(reply, i, slot), ctx))
+                    pending += 1
+                    continue
+                # Every actor is busy: run the task in this thread, which
+                # also keeps nested steps from waiting on their caller.
+                while pending and not done.empty():
+                    pending -= 1
+                    finished = gather.add(*done.get())
+                    if finished:
+                        break
+                if finished:
+                    break
+                try:
+                    outcome = i, True, _run_task(task, shared)
+                # pylint: disable=W0718
+                except Exception as exp:
+                    outcome = i, False, exp
+                if gather.add(*outcome):
+                    finished = True
+                    break
+            while pending and not finished:
+                pending -= 1
+                finished = gather.add(*done.get())
+            return gather.result()
+
+        async def _run_async(self, shared):
+            if self.backend == "process":
+                loop = asyncio.get_running_loop()
+                executor = self._executor or _process_executor()
+                futures = [loop.run_in_executor(executor, _run_pickled, p)
+                           for p in self._payloads(shared)]
+            else:
+                futures = [asyncio.ensure_future(t.run_async(shared))
+                           for t in self._tasks]
+            index = {f: i for i, f in enumerate(futures)}
+            gather, pending = _Gather(self), set(futures)
+            try:
+                while pending:
+                    finished, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED)
+                    if any([gather.add(*self._outcome(index[f], f))
+                            for f in finished]):
+                        break
+            finally:
+                for f in pending:
+                    f.cancel()
+            if self.backend == "process":
+                self._merge(shared, futures)
+            return gather.result()
+
+        def _outcome(self, index, fut):
+            if fut.exception() is not None:
+                return index, False, fut.exception()
+            res = fut.result()
+            return index, True, res[0] if self.backend == "process" else res
 
-            for s in prep_res:
-                s.stop()
-            return results[0]
+        def _payloads(self, shared):
+            view = pickle.dumps(_picklable_view(shared))
+            return [(pickle.dumps(t), view) for t in self._tasks]
+
+        @staticmethod
+        def _merge(shared, futures):
+            for f in futures:
+                if f.done() and not f.cancelled() and f.exception() is None:
+                    _apply_delta(shared, f.result()[1])
+
+        def _run_processes(self, shared):
+            executor = self._executor or _process_executor()
+            futures = [executor.submit(_run_pickled, payload)
+                       for payload in self._payloads(shared)]
+            index = {f: i for i, f in enumerate(futures)}
+            gather = _Gather(self)
+            try:
+                for f in as_completed(futures):
+                    if gather.add(*self._outcome(index[f], f)):
+                        break
+            finally:
+                for f in futures:
+                    f.cancel()
+            self._merge(shared, futures)
+            return gather.result()
 
 except ImportError:
     logger.warning("Install Pykka to enable ParallelStep.")
+
+
+class _AllocObserver(FlowObserver):
+    """Net bytes (from ``tracemalloc``) and memory blocks (from
+    ``sys.getallocatedblocks``) each node class leaves allocated.
+    Both are process-wide, so concurrent tasks are charged to whichever
+    nodes are running."""
+
+    def __init__(self):
+        import tracemalloc # pylint: disable=C0415
+        self.nodes = {}
+        self._local = threading.local()
+        self._traced = tracemalloc.get_traced_memory
+
+    def before_node(self, node, shared):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append((self._traced()[0], sys.getallocatedblocks()))
+
+    def after_node(self, node, shared, action, error):
+        blocks = sys.getallocatedblocks()
+        size = self._traced()[0]
+        size0, blocks0 = self._local.stack.pop()
+        entry = self.nodes.get(node.__class__.__name__)
+        if entry is None:
+            entry = self.nodes[node.__class__.__name__] = [0, 0, 0]
+        entry[0] += 1
+        entry[1] += size - size0
+        entry[2] += blocks - blocks0
+
+def _profiler_lines():
+    """``(filename, lineno)`` of the code the profiler itself runs
+    around the flow, whose allocations are left out of the report."""
+    lines = set()
+    for fn in (_AllocObserver.__init__, _AllocObserver.before_node,
+               _AllocObserver.after_node, _profile_runs, Flow.observe,
+               Flow.unobserve, Flow._run, Flow._run_observed,
+               _run_observed_node, _observed_phase, _run_task):
+        code = fn.__code__
+        lines.update((code.co_filename, line)
+                     for _, _, line in code.co_lines() if line is not None)
+    return lines
+
+class _HookProfiler(FlowObserver):
+    """Runs ``cProfile`` only while node hooks run, one profiler per
+    thread."""
+
+    def __init__(self):
+        import cProfile # pylint: disable=C0415
+        self._profile = cProfile.Profile
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profilers = []
+
+    def before_phase(self, node, phase):
+        local = self._local
+        if getattr(local, "profiler", None) is None:
+            local.profiler, local.depth = self._profile(), 0
+            with self._lock:
+                self._profilers.append(local.profiler)
+        if local.depth == 0:
+            local.profiler.enable()
+        local.depth += 1
+
+    def after_phase(self, node, phase, error):
+        local = self._local
+        local.depth -= 1
+        if local.depth == 0:
+            local.profiler.disable()
+
+    def dump(self, path):
+        with self._lock:
+            profilers = list(self._profilers)
+        if profilers:
+            import pstats # pylint: disable=C0415
+            stats = pstats.Stats(*profilers)
+            stats.dump_stats(path)
+
+class _CollapsedStacks:
+    """A ``Tracer`` exporter summing the time spent in node phases by
+    span stack, in the collapsed format flame graph tools read.
+
+    Only phase spans are counted, less the time of flows nested in
+    them, so engine time between hooks is left out.
+    """
+
+    def __init__(self):
+        self.stacks = {}
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans[span["span_id"]] = span
+            if span["parent_id"] is None:
+                spans, self._spans = self._spans, {}
+                self._add(spans)
+
+    def _add(self, spans):
+        covered = {}
+        for span in spans.values():
+            if span["parent_id"] in spans:
+                covered[span["parent_id"]] = (covered.get(span["parent_id"],
+                                                          0.0) +
+                                              span["end"] - span["start"])
+        for span in spans.values():
+            if span["kind"] != "phase":
+                continue
+            names, parent = [], span
+            while parent is not None:
+                names.append(parent["name"])
+                parent = spans.get(parent["parent_id"])
+            own = (span["end"] - span["start"] -
+                   covered.get(span["span_id"], 0.0))
+            stack = ";".join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + max(0.0, own)
+
+    def close(self):
+        pass
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                f.write(f"{stack} {round(seconds * 1e6)}\n")
+
+def _load_target(spec):
+    """Import ``module:attr`` (``attr`` may be dotted) as a Flow.
+
+    A Node is wrapped in a Flow and any other callable is called to
+    build one.
+    """
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"Expected module:attribute, got '{spec}'")
+    if "" not in sys.path and os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    import importlib # pylint: disable=C0415
+    target = importlib.import_module(module_name)
+    for part in attr.split("."):
+        target = getattr(target, part)
+    if not isinstance(target, BaseNode) and callable(target):
+        target = target()
+    if not isinstance(target, Flow):
+        target = Flow(start=target)
+    return target
+
+def _profile_runs(flow, inputs, runs, observers):
+    import copy # pylint: disable=C0415
+    for o in observers:
+        flow.observe(o)
+    try:
+        start = time.perf_counter()
+        for i in range(runs):
+            flow.run(copy.deepcopy(inputs[i % len(inputs)]))
+        return time.perf_counter() - start
+    finally:
+        for o in observers:
+            flow.unobserve(o)
+
+def profile(flow, inputs, runs=100, alloc_runs=100, cprofile=None,
+            collapsed=None):
+    """Run ``flow`` over ``inputs`` (cycled) and report where time and
+    memory go.
+
+    The timing pass runs ``runs`` times with a ``ProfileObserver`` and
+    a ``StatsObserver``.  ``alloc_runs`` more runs under ``tracemalloc``
+    give each node's net allocations and the top allocation sites.  With
+    ``cprofile`` or ``collapsed`` a further ``runs`` runs write a
+    ``cProfile`` dump of the node hooks, or their collapsed stacks, to
+    those paths.  Returns a JSON-ready report.
+    """
+    import tracemalloc # pylint: disable=C0415
+    timings, stats = ProfileObserver(), StatsObserver()
+    elapsed = _profile_runs(flow, inputs, runs, (timings, stats))
+    snapshot, histograms = timings.snapshot(), stats.snapshot()["nodes"]
+    total = sum(n["wall"] for n in snapshot["nodes"].values()) or 1.0
+    report = {"runs": runs, "seconds": elapsed,
+              "per_run": elapsed / runs if runs else None, "nodes": {}}
+    for name, node in sorted(snapshot["nodes"].items(),
+                             key=lambda item: -item[1]["wall"]):
+        report["nodes"][name] = {
+            **node, "share": node["wall"] / total,
+            "retries": snapshot["retries"].get(name, 0),
+            "phases": {phase: hist.summary()
+                       for phase, hist in histograms.get(name, {}).items()}}
+
+    if alloc_runs:
+        allocs = _AllocObserver()
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            _profile_runs(flow, inputs, alloc_runs, (allocs,))
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+        for name, (count, size, blocks) in allocs.nodes.items():
+            entry = report["nodes"].setdefault(name, {})
+            entry["alloc_bytes_per_call"] = size / count
+            entry["alloc_blocks_per_call"] = blocks / count
+        own = _profiler_lines()
+        diffs = after.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        ).compare_to(before, "lineno")
+        report["alloc_runs"] = alloc_runs
+        report["alloc_sites"] = [
+            {"site": str(diff.traceback), "blocks": diff.count_diff,
+             "bytes": diff.size_diff}
+            for diff in diffs
+            if (diff.traceback[0].filename,
+                diff.traceback[0].lineno) not in own][:10]
+
+    if cprofile or collapsed:
+        hooks, stacks = _HookProfiler(), _CollapsedStacks()
+        observers = (hooks,) if cprofile else ()
+        if collapsed:
+            observers += (Tracer(stacks),)
+        _profile_runs(flow, inputs, runs, observers)
+        if cprofile:
+            hooks.dump(cprofile)
+        if collapsed:
+            stacks.dump(collapsed)
+    return report
+
+def _print_report(report, out):
+    out.write(f"{report['runs']} runs in {report['seconds']:.3f}s "
+              f"({report['per_run'] * 1e3:.3f} ms/run)\n\n")
+    out.write(f"{'node':<24}{'calls':>8}{'share':>8}{'wall ms':>11}"
+              f"{'cpu ms':>11}{'p50 ms':>9}{'p99 ms':>9}{'retries':>9}"
+              f"{'alloc B':>10}{'blocks':>8}\n")
+    for name, node in report["nodes"].items():
+        if "count" not in node:
+            continue
+        phase = node["phases"].get("node", {})
+        alloc = node.get("alloc_bytes_per_call")
+        blocks = node.get("alloc_blocks_per_call")
+        out.write(f"{name[:23]:<24}{node['count']:>8}"
+                  f"{node['share']:>8.1%}{node['wall'] * 1e3:>11.3f}"
+                  f"{node['cpu'] * 1e3:>11.3f}"
+                  f"{(phase.get('p50') or 0) * 1e3:>9.3f}"
+                  f"{(phase.get('p99') or 0) * 1e3:>9.3f}"
+                  f"{node['retries']:>9}"
+                  f"{'' if alloc is None else round(alloc):>10}"
+                  f"{'' if blocks is None else round(blocks):>8}\n")
+    if report.get("alloc_sites"):
+        out.write(f"\nTop allocation sites over {report['alloc_runs']} "
+                  "runs:\n")
+        for site in report["alloc_sites"]:
+            out.write(f"  {site['blocks']:>+8} blocks {site['bytes']:>+10} B"
+                      f"  {site['site']}\n")
+
+def _positive_int(text):
+    import argparse # pylint: disable=C0415
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"expected at least 1, got {value}")
+    return value
+
+def _non_negative_int(text):
+    import argparse # pylint: disable=C0415
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"expected at least 0, got {value}")
+    return value
+
+def main(argv=None):
+    """The ``python -m nethervortex`` command line."""
+    import argparse # pylint: disable=C0415
+    parser = argparse.ArgumentParser(prog="python -m nethervortex")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prof = commands.add_parser("profile",
+                               help="profile a flow over recorded inputs")
+    prof.add_argument("target", help="module:attribute naming a Flow, a "
+                      "Node or a callable returning one")
+    prof.add_argument("--input", required=True,
+                      help="JSON file holding one SharedData or a list")
+    prof.add_argument("--runs", type=_positive_int, default=100)
+    prof.add_argument("--alloc-runs", type=_non_negative_int, default=None,
+                      help="runs under tracemalloc (default: min(runs, "
+                      "100); 0 disables)")
+    prof.add_argument("--cprofile", metavar="PATH",
+                      help="write a cProfile dump of the node hooks")
+    prof.add_argument("--collapsed", metavar="PATH",
+                      help="write collapsed stacks for flame graphs")
+    prof.add_argument("--json", metavar="PATH",
+                      help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    flow = _load_target(args.target)
+    with open(args.input, encoding="utf-8") as f:
+        inputs = json.load(f)
+    if not isinstance(inputs, list):
+        inputs = [inputs]
+    alloc_runs = (min(args.runs, 100) if args.alloc_runs is None
+                  else args.alloc_runs)
+    report = profile(flow, inputs, args.runs, alloc_runs,
+                     cprofile=args.cprofile, collapsed=args.collapsed)
+    _print_report(report, sys.stdout)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    # Run the imported module's copy, so that the node classes the user's
+    # flow is built from are the ones the profiler checks against.
+    import nethervortex # pylint: disable=W0406
+    sys.exit(nethervortex.main())
@@ -1,11 +1,21 @@
 """Tests for the nethervortex library components."""
 
+import asyncio
+import functools
+import json
 import logging
+import os
+import pickle
+import threading
 import time
 
 import pytest
 
-from nethervortex import Node, Flow, ParallelStep, SharedData
+from nethervortex import (ChromeTraceExporter, CriticalPathStats, DiskMemo,
+                          FileCheckpoints, Flow, JsonLinesExporter,
+                          LatencyHistogram, MapStep, Memo, Node,
+                          ParallelStep, ProfileObserver, SharedData,
+                          SQLiteCheckpoints, Tracer, main)
 
 # Configure logging to capture output for assertions
 logging.basicConfig(level=logging.DEBUG)
@@ -138,6 +148,41 @@ class AlwaysFailingNode(Node):
         return exec_res  # Or None, as it won't be called
 
 
+class PidNode(Node):
+    """Records the worker process id in its component."""
+    COMP = "P"
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, *, tag, **_):
+        shared["cmpnt"]["P"] = {"pid": os.getpid(), "tag": tag}
+        return os.getpid()
+
+
+class SquareNode(Node):
+    """Squares a number held in its component."""
+    COMP = "Q"
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        shared["cmpnt"]["Q"]["value"] **= 2
+
+
+class DoubleNode(Node):
+    """Doubles the mapped item."""
+
+    # pylint: disable=W0613
+    def prelude(self, shared, **_):
+        return shared["item"]
+
+    # pylint: disable=W0613
+    def dispatch(self, prelude_res, *, factor=2, **_):
+        return prelude_res * factor
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        return exec_res
+
+
 # pylint: disable=W0621
 @pytest.fixture
 def capture_logs(caplog):
@@ -151,7 +196,9 @@ def reset_all_node_singletons():
     classes.
     """
     for node_class in [ANode, BNode, CNode, DNode,
-                       FailingNode, AlwaysFailingNode]:
+                       FailingNode, AlwaysFailingNode, PidNode, SquareNode,
+                       AsyncNode, CountNode, FlakyNode,
+                       DoubleNode]:
         # pylint: disable=W0212
         if hasattr(node_class, "_instance"):
             node_class._instance = None
@@ -285,3 +332,1101 @@ def test_node_retry_exhaustion():
         always_failing_node.run(shared=initial_shared)
 
     assert AlwaysFailingNode.call_count == 2
+
+
+# pylint: disable=W0621
+def test_compiled_flow_matches_dynamic_walk(capture_logs):
+    """A compiled flow follows the same transitions as the dynamic one."""
+    anode = ANode()
+    dnode = DNode()
+
+    # pylint: disable=W0104
+    anode >> dnode
+    dnode - "again" >> anode
+
+    flow = Flow(start=anode).compile()
+    # pylint: disable=W0212
+    assert flow._plan.nodes == (anode, dnode)
+    assert flow._plan.jumps == ({"default": 1}, {"again": 0})
+
+    final_action = flow.run(shared=SharedData(
+        config={"arg1": "arg1_v"},
+        cmpnt={"D": {"config": {"arg2": "arg2_v"}}},
+        state=None
+    ))
+
+    assert final_action == "finish"
+    assert capture_logs.text.count("ANode prelude") == 3
+    assert "DNode postlude: finish" in capture_logs.text
+
+
+def test_hook_table_resolved_per_class():
+    """Hooks and COMP are resolved once per Node subclass."""
+
+    class PostOnlyNode(Node):
+        """Defines only a postlude."""
+        COMP = "P"
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, *, flag, **_):
+            return (prep_res, exec_res, flag)
+
+    class EmptyNode(Node):
+        """Defines no hooks at all."""
+
+    # pylint: disable=W0212
+    assert PostOnlyNode._hooks[:2] == (None, None)
+    assert PostOnlyNode._comp == "P"
+    assert EmptyNode._idle and not PostOnlyNode._idle
+
+    shared = SharedData(config={"flag": 1},
+                        cmpnt={"P": {"config": {"flag": 2}}}, state=None)
+    assert PostOnlyNode().run(shared) == (None, None, 2)
+    assert EmptyNode().run(shared) is None
+    assert shared["state"] == "EmptyNode"
+
+
+def test_layered_config_view():
+    """Merged configs are views that see changes to either layer."""
+    # pylint: disable=W0212,C0415
+    from nethervortex import _LayeredConfig
+
+    shared = SharedData(config={"a": 1, "b": 1},
+                        cmpnt={"D": {"config": {"b": 2}}}, state=None)
+
+    view = _LayeredConfig.of(shared, "D")
+    assert dict(view) == {"a": 1, "b": 2}
+    assert view["b"] == 2 and "a" in view and "c" not in view
+    assert dict(_LayeredConfig.of(shared, None)) == {"a": 1, "b": 1}
+
+    shared["cmpnt"]["D"]["config"]["b"] = 3
+    shared["config"]["a"] = 5
+    assert view["a"] == 5 and view["b"] == 3
+    # The layers are read in place, never copied for declared keys.
+    assert view.base is shared["config"]
+
+
+def test_hook_signature_binding():
+    """Hooks receive only declared config keys unless they read kwargs."""
+
+    class BindNode(Node):
+        """Mixes declared keys, unused and used **kwargs."""
+
+        # pylint: disable=W0613
+        def prelude(self, shared, *, arg1, **_):
+            return arg1
+
+        # pylint: disable=W0613
+        def dispatch(self, prelude_res, **kwargs):
+            return sorted(kwargs)
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, opt=None):
+            return (prep_res, exec_res, opt)
+
+    # pylint: disable=W0212
+    assert BindNode._hook_args == (("arg1",), None, ("opt",))
+
+    shared = SharedData(config={"arg1": 1, "opt": 2, "other": 3},
+                        cmpnt={}, state=None)
+    assert BindNode().run(shared) == (1, ["arg1", "opt", "other"], 2)
+
+
+def test_decorated_hook_gets_the_whole_config():
+    """A hook behind a functools.wraps decorator that forwards
+    **kwargs receives the whole config."""
+
+    def traced(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return fn(*args, **kwargs)
+        return wrapper
+
+    class DecoratedNode(Node):
+        """Its postlude reads **cfg through a decorator."""
+
+        @traced
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **cfg):
+            return sorted(cfg)
+
+    # pylint: disable=W0212
+    assert DecoratedNode._hook_args[2] is None
+    shared = SharedData(config={"a": 1, "b": 2}, cmpnt={}, state=None)
+    assert DecoratedNode().run(shared) == ["a", "b"]
+
+
+def test_static_class_and_instance_hooks():
+    """Static and class method hooks, and hooks assigned on the
+    instance, are called like ordinary methods."""
+
+    class StaticNode(Node):
+        """A static postlude."""
+
+        @staticmethod
+        def postlude(shared, prep_res, exec_res, *, tag="s", **_):
+            return tag
+
+    class ClassNode(Node):
+        """A class method postlude."""
+        TAG = "c"
+
+        @classmethod
+        def postlude(cls, shared, prep_res, exec_res, **_):
+            return cls.TAG
+
+    class InstanceNode(Node):
+        """Gets its postlude assigned after creation."""
+
+    shared = SharedData(config={}, cmpnt={}, state=None)
+    assert StaticNode().run(shared) == "s"
+    assert ClassNode().run(shared) == "c"
+    node = InstanceNode()
+    assert node.run(shared) is None
+    node.postlude = lambda shared, prep_res, exec_res, **_: "i"
+    assert node.run(shared) == "i"
+    del node.postlude
+    assert node.run(shared) is None
+
+
+def test_parallel_step_reuses_pooled_actors():
+    """ParallelStep borrows actors from its pool instead of starting new
+    ones on every run."""
+    # pylint: disable=C0415
+    from nethervortex import PSlotPool
+
+    pool = PSlotPool(size=2)
+    step = ParallelStep(pool=pool)[BNode(), CNode()]
+    shared = SharedData(config={}, cmpnt={}, state=None)
+    try:
+        step.run(shared)
+        # pylint: disable=W0212
+        first = set(id(s) for s in pool._idle)
+        step.run(shared)
+        assert set(id(s) for s in pool._idle) == first
+        assert len(first) == 2
+    finally:
+        pool.shutdown()
+
+
+def test_parallel_step_pool_bounds_threads():
+    """A step wider than its pool runs the extra tasks in the calling
+    thread, and nested steps sharing a saturated pool still finish."""
+    # pylint: disable=C0415
+    from nethervortex import PSlotPool
+
+    threads = set()
+
+    class ThreadNode(Node):
+        """Records the thread it ran on."""
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            threads.add(threading.get_ident())
+            time.sleep(0.01)
+            return "ok"
+
+    pool = PSlotPool(size=2)
+    task = ThreadNode()
+    shared = SharedData(config={}, cmpnt={}, state=None)
+    try:
+        wide = ParallelStep(pool=pool, collect="all")[(task,) * 8]
+        assert wide.run(shared) == ["ok"] * 8
+        assert len(threads) <= 3
+        # pylint: disable=W0212
+        assert pool._started == 2
+
+        inner = ParallelStep(pool=pool, collect="all")[task, task, task]
+        outer = ParallelStep(pool=pool, collect="all")[inner, inner, task]
+        assert outer.run(shared) == [["ok"] * 3, ["ok"] * 3, "ok"]
+        assert pool._started == 2
+    finally:
+        pool.shutdown()
+
+
+def test_parallel_step_process_backend():
+    """Process-backed tasks run in worker processes and their changes to
+    shared are merged back."""
+    lock = threading.Lock()
+    step = ParallelStep(backend="process")[PidNode(), SquareNode()]
+    shared = SharedData(config={"tag": "t"},
+                        cmpnt={"Q": {"value": 3}, "L": lock}, state=None)
+
+    pid = step.run(shared)
+
+    assert pid != os.getpid()
+    assert shared["cmpnt"]["P"] == {"pid": pid, "tag": "t"}
+    assert shared["cmpnt"]["Q"] == {"value": 9}
+    assert shared["cmpnt"]["L"] is lock
+
+    with pytest.raises(ValueError):
+        ParallelStep(backend="fiber")
+
+
+class AsyncNode(Node):
+    """A node with coroutine hooks that fails once before succeeding."""
+    COMP = "A"
+    call_count = 0
+
+    # pylint: disable=W0613
+    async def prelude(self, shared, *, arg1, **_):
+        await asyncio.sleep(0)
+        return arg1
+
+    # pylint: disable=W0613
+    async def dispatch(self, prelude_res, **_):
+        AsyncNode.call_count += 1
+        if AsyncNode.call_count == 1:
+            raise ValueError("flaky")
+        return prelude_res.upper()
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        shared["cmpnt"]["A"]["seen"] = exec_res
+
+
+def test_async_flow_with_parallel_gather():
+    """Coroutine hooks, async retries and gathered parallel steps."""
+    AsyncNode.call_count = 0
+    anode = AsyncNode(retry_waits=[0.01])
+    step = ParallelStep()[BNode(), CNode()]
+    # pylint: disable=W0104
+    anode >> step
+    flow = Flow(start=anode)
+    shared = SharedData(config={"arg1": "x"}, cmpnt={"A": {}}, state=None)
+
+    assert asyncio.run(flow.run_async(shared)) is None
+    assert shared["cmpnt"]["A"]["seen"] == "X"
+    assert AsyncNode.call_count == 2
+    assert shared["state"] in ("BNode", "CNode")
+
+    with pytest.raises(TypeError, match="run_async"):
+        AsyncNode().run(shared)
+    anode.successors.clear()
+
+
+def test_run_async_keeps_overridden_phases():
+    """run_async goes through a subclass's own _exec1 like run does."""
+
+    class CustomExec(Node):
+        """Replaces the dispatch phase."""
+
+        def dispatch(self, prelude_res, **_):
+            return "raw"
+
+        def _exec1(self, prep_res):
+            return "custom-exec1"
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            return exec_res
+
+    node = CustomExec()
+    shared = SharedData(config={}, cmpnt={}, state=None)
+    assert node.run(shared) == "custom-exec1"
+    assert asyncio.run(node.run_async(shared)) == "custom-exec1"
+
+
+class CountNode(Node):
+    """Counts up to the limit held in shared["cmpnt"]["C"]."""
+    COMP = "C"
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        comp = shared["cmpnt"]["C"]
+        if comp["n"] >= comp["limit"]:
+            if comp["limit"] < 0:
+                raise ValueError("negative limit")
+            return comp["n"]
+        comp["n"] += 1
+        return "again"
+
+
+def test_flow_run_many_ordered_and_unordered():
+    """run_many streams inputs through a worker pool."""
+    cnode = CountNode()
+    cnode - "again" >> cnode
+    flow = Flow(start=cnode)
+
+    def inputs(limits):
+        for limit in limits:
+            yield SharedData(config={},
+                             cmpnt={"C": {"n": 0, "limit": limit}},
+                             state=None)
+
+    results = list(flow.run_many(inputs(range(20)), concurrency=3))
+    assert [r for _, r in results] == list(range(20))
+    assert all(s["cmpnt"]["C"]["n"] == r for s, r in results)
+
+    unordered = flow.run_many(inputs([5, -1, 2]), ordered=False,
+                              return_exceptions=True)
+    got = {s["cmpnt"]["C"]["limit"]: r for s, r in unordered}
+    assert got[5] == 5 and got[2] == 2
+    assert isinstance(got[-1], ValueError)
+
+    with pytest.raises(ValueError):
+        list(flow.run_many(inputs([1, -1])))
+    cnode.successors.clear()
+
+
+class FlakyNode(Node):
+    """Fails the first dispatch of every input, then succeeds."""
+    COMP = "F"
+
+    # pylint: disable=W0613
+    def prelude(self, shared, **_):
+        return shared["cmpnt"]["F"]
+
+    def dispatch(self, prelude_res, **_):
+        prelude_res["attempts"] += 1
+        if prelude_res["attempts"] == 1:
+            raise ValueError("flaky upstream")
+        return threading.current_thread().name
+
+    # pylint: disable=W0613
+    def postlude(self, shared, prep_res, exec_res, **_):
+        return prep_res["attempts"]
+
+
+def test_run_many_parks_flows_during_retry_backoff():
+    """A backing-off run frees its worker for other inputs."""
+    FlakyNode(retry_waits=[0.2])
+    flow = Flow(start=FlakyNode())
+    inputs = [SharedData(config={}, cmpnt={"F": {"attempts": 0}},
+                         state=None) for _ in range(8)]
+
+    start = time.monotonic()
+    results = list(flow.run_many(inputs, concurrency=1, max_pending=8))
+    elapsed = time.monotonic() - start
+
+    assert [r for _, r in results] == [2] * 8
+    # Sleeping in place would take 8 * 0.2s on a single worker.
+    assert elapsed < 1.0
+
+
+def test_parallel_step_collect_modes():
+    """ParallelStep aggregates task results according to ``collect``."""
+
+    class SlowNode(Node):
+        """Returns late."""
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            time.sleep(0.3)
+            return "slow"
+
+    class FastNode(Node):
+        """Returns early."""
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            return "fast"
+
+    class BrokenNode(Node):
+        """Always raises."""
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            raise RuntimeError("broken")
+
+    slow, fast, broken = SlowNode(), FastNode(), BrokenNode()
+
+    def run(step):
+        return step.run(SharedData(config={}, cmpnt={}, state=None))
+
+    assert run(ParallelStep()[slow, fast]) == "slow"
+    assert run(ParallelStep(collect="all")[slow, fast]) == ["slow", "fast"]
+    assert run(ParallelStep(collect="reduce", reducer="+".join)
+               [slow, fast]) == "slow+fast"
+
+    start = time.monotonic()
+    assert run(ParallelStep(collect="first_completed")
+               [slow, broken, fast]) == "fast"
+    assert run(ParallelStep(collect="quorum", quorum=1)
+               [slow, fast]) == ["fast"]
+    assert time.monotonic() - start < 0.3
+
+    with pytest.raises(RuntimeError, match="broken"):
+        run(ParallelStep(collect="all")[fast, broken])
+    with pytest.raises(RuntimeError, match="broken"):
+        run(ParallelStep(collect="quorum", quorum=2)[fast, broken])
+    assert run(ParallelStep(collect="quorum", quorum=2)
+               [fast, fast]) == ["fast", "fast"]
+    with pytest.raises(ValueError, match="exceeds"):
+        ParallelStep(collect="quorum", quorum=3)[fast, slow]
+    with pytest.raises(ValueError, match="at least 1"):
+        ParallelStep(collect="quorum", quorum=-1)
+
+    # A list of results takes the default transition inside a flow.
+    step = ParallelStep(collect="all")[fast, fast]
+    step >> CNode()
+    assert Flow(start=step).run(
+        SharedData(config={}, cmpnt={}, state=None)) is None
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_map_step_chunks_items_in_order(backend):
+    """MapStep applies a node to every item and keeps item order."""
+    step = MapStep(DoubleNode(), "numbers", target="doubled",
+                   chunk_size=3, max_workers=2, backend=backend)
+    shared = SharedData(config={"factor": 3}, cmpnt={}, state=None)
+    shared["numbers"] = list(range(10))
+
+    assert step.run(shared) == [n * 3 for n in range(10)]
+    assert shared["doubled"] == [n * 3 for n in range(10)]
+    assert "item" not in shared
+
+    by_callable = MapStep(DoubleNode(), lambda s: s["numbers"][:2])
+    assert by_callable.run(shared) == [0, 3]
+
+
+def test_flow_stream_pipelines_linear_flow():
+    """Streaming overlaps stages and keeps input order."""
+
+    class SlowStage(Node):
+        """Sleeps in every stage."""
+        COMP = "S"
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            time.sleep(0.05)
+            shared["cmpnt"]["S"]["trail"].append(self.__class__.__name__)
+            return "stop" if shared["cmpnt"]["S"]["n"] == 3 else None
+
+    class StageOne(SlowStage):
+        """First stage."""
+
+    class StageTwo(SlowStage):
+        """Second stage."""
+
+    class StageThree(SlowStage):
+        """Third stage."""
+
+    one, two, three = StageOne(), StageTwo(), StageThree()
+    # pylint: disable=W0104
+    one >> two >> three
+    flow = Flow(start=one)
+    inputs = [SharedData(config={}, cmpnt={"S": {"n": n, "trail": []}},
+                         state=None) for n in range(8)]
+
+    start = time.monotonic()
+    results = list(flow.stream(inputs, maxsize=2))
+    elapsed = time.monotonic() - start
+
+    assert [s["cmpnt"]["S"]["n"] for s, _ in results] == list(range(8))
+    assert results[3][1] == "stop"
+    assert results[3][0]["cmpnt"]["S"]["trail"] == ["StageOne"]
+    assert results[0][0]["cmpnt"]["S"]["trail"] == [
+        "StageOne", "StageTwo", "StageThree"]
+    # Sequentially this would take about 22 * 0.05s.
+    assert elapsed < 0.9
+
+    two - "retry" >> one
+    with pytest.raises(ValueError, match="linear"):
+        list(flow.stream(inputs))
+
+
+def test_memoized_dispatch():
+    """MEMO caches dispatch results per prelude result and used config."""
+
+    class SquareMemoNode(Node):
+        """Squares shared["x"], memoized."""
+        MEMO = Memo(maxsize=2, ttl=0.2)
+        calls = 0
+
+        # pylint: disable=W0613
+        def prelude(self, shared, **_):
+            return shared["x"]
+
+        # pylint: disable=W0613
+        def dispatch(self, prelude_res, *, power, **_):
+            SquareMemoNode.calls += 1
+            return prelude_res ** power
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            return exec_res
+
+    node = SquareMemoNode()
+
+    def run(x, power=2, other=0):
+        shared = SharedData(config={"power": power, "other": other},
+                            cmpnt={}, state=None)
+        shared["x"] = x
+        return node.run(shared)
+
+    assert [run(3), run(3), run(3, other=1)] == [9, 9, 9]
+    assert SquareMemoNode.calls == 1
+    assert run(3, power=3) == 27
+    assert SquareMemoNode.calls == 2
+    assert SquareMemoNode.MEMO.stats() == {"hits": 2, "misses": 2,
+                                           "size": 2}
+
+    run(4)  # evicts the least recently used entry, x=3 power=2
+    run(3)
+    assert SquareMemoNode.calls == 4
+
+    time.sleep(0.25)
+    run(3)
+    assert SquareMemoNode.calls == 5
+
+
+def test_disk_memo_survives_restart_and_evicts(tmp_path):
+    """DiskMemo persists results and stays under its byte budget."""
+    memo = DiskMemo(tmp_path, max_bytes=2000, touch_interval=0)
+    memo.store("a", "x" * 900)
+    memo.store("b", "y" * 900)
+    assert memo.lookup("a") == (True, "x" * 900)
+
+    # A fresh instance, as after a restart, sees the same entries.
+    again = DiskMemo(tmp_path, max_bytes=2000, touch_interval=0)
+    assert again.lookup("b") == (True, "y" * 900)
+    # "a" is now the least recently used entry and gets evicted.
+    again.store("c", "z" * 900)
+    assert again.lookup("a") == (False, None)
+    stats = again.stats()
+    assert stats["size"] == 2
+    assert stats["bytes"] < 2000
+    # Replacing an entry updates the running byte total.
+    again.store("c", "z")
+    shrink = len(pickle.dumps("z" * 900)) - len(pickle.dumps("z"))
+    assert again.stats()["bytes"] == stats["bytes"] - shrink
+
+    expiring = DiskMemo(tmp_path, ttl=0)
+    assert expiring.lookup("c") == (False, None)
+
+
+def test_disk_memo_on_node(tmp_path):
+    """A node can keep its dispatch results in a DiskMemo."""
+
+    class EmbedNode(Node):
+        """Pretends to compute an expensive embedding."""
+        MEMO = DiskMemo(tmp_path)
+        calls = 0
+
+        # pylint: disable=W0613
+        def prelude(self, shared, **_):
+            return shared["text"]
+
+        def dispatch(self, prelude_res, **_):
+            EmbedNode.calls += 1
+            return [len(prelude_res)]
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            return exec_res
+
+    shared = SharedData(config={}, cmpnt={}, state=None)
+    shared["text"] = "hello"
+    assert EmbedNode().run(shared) == [5]
+    assert EmbedNode().run(shared) == [5]
+    assert EmbedNode.calls == 1
+    assert DiskMemo(tmp_path).stats()["size"] == 1
+
+
+def test_coalesced_dispatch_shares_one_execution():
+    """Concurrent identical dispatch calls run once with COALESCE."""
+
+    class LookupNode(Node):
+        """A slow lookup shared by concurrent flows."""
+        COALESCE = True
+        calls = 0
+
+        # pylint: disable=W0613
+        def prelude(self, shared, **_):
+            return shared["query"]
+
+        def dispatch(self, prelude_res, **_):
+            LookupNode.calls += 1
+            time.sleep(0.2)
+            if prelude_res == "bad":
+                raise KeyError(prelude_res)
+            return prelude_res.upper()
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            return exec_res
+
+    flow = Flow(start=LookupNode())
+
+    def inputs(query, n):
+        for _ in range(n):
+            shared = SharedData(config={}, cmpnt={}, state=None)
+            shared["query"] = query
+            yield shared
+
+    results = list(flow.run_many(inputs("q", 5), concurrency=5))
+    assert [r for _, r in results] == ["Q"] * 5
+    assert LookupNode.calls == 1
+
+    failed = list(flow.run_many(inputs("bad", 3), concurrency=3,
+                                return_exceptions=True))
+    assert all(isinstance(r, KeyError) for _, r in failed)
+    # The first attempt and the default retry are each shared.
+    assert LookupNode.calls == 1 + 2
+
+    # Sequential calls are not coalesced.
+    before = LookupNode.calls
+    list(flow.run_many(inputs("q", 2), concurrency=1))
+    assert LookupNode.calls == before + 2
+
+
+def test_dispatch_calls_are_micro_batched():
+    """Concurrent flows share dispatch_batch calls."""
+
+    class ModelNode(Node):
+        """Scores inputs in batches."""
+        BATCH_SIZE = 4
+        BATCH_WAIT = 0.1
+        batches = []
+
+        # pylint: disable=W0613
+        def prelude(self, shared, **_):
+            return shared["x"]
+
+        def dispatch_batch(self, inputs, *, scale, **_):
+            ModelNode.batches.append(len(inputs))
+            return [x * scale for x in inputs]
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            return exec_res
+
+    def inputs(n):
+        for x in range(n):
+            shared = SharedData(config={"scale": 10}, cmpnt={}, state=None)
+            shared["x"] = x
+            yield shared
+
+    flow = Flow(start=ModelNode())
+    results = list(flow.run_many(inputs(8), concurrency=8))
+
+    assert [r for _, r in results] == [x * 10 for x in range(8)]
+    assert sum(ModelNode.batches) == 8
+    assert max(ModelNode.batches) <= 4
+    assert len(ModelNode.batches) < 8
+
+    # A lone call runs as a batch of one after BATCH_WAIT.
+    assert ModelNode().run(next(inputs(1))) == 0
+    assert ModelNode.batches[-1] == 1
+
+    with pytest.raises(TypeError, match="coroutine"):
+        # pylint: disable=W0612
+        class AsyncModelNode(Node):
+            """Cannot batch with a coroutine."""
+
+            async def dispatch_batch(self, inputs, **_):
+                return inputs
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_run_columns_routes_records_by_mask(use_numpy, monkeypatch):
+    """Vectorized runs route records in bulk by per-record actions."""
+    # pylint: disable=C0415
+    import nethervortex
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(nethervortex, "_np", None)
+
+    class DoubleColumn(Node):
+        """Doubles the x column."""
+        calls = 0
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            DoubleColumn.calls += 1
+            cols = shared["columns"]
+            cols["x"] = [v * 2 for v in cols["x"]]
+
+    class CheckColumn(Node):
+        """Sends small values round again."""
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, *, limit, **_):
+            xs = shared["columns"]["x"]
+            shared["columns"]["big"] = [v >= limit for v in xs]
+            return ["again" if v < limit else "done" for v in xs]
+
+    double, check = DoubleColumn(), CheckColumn()
+    # pylint: disable=W0104
+    double >> check
+    check - "again" >> double
+    flow = Flow(start=double)
+
+    actions, columns = flow.run_columns(
+        SharedData(config={"limit": 10}, cmpnt={}, state=None),
+        {"x": [1, 5, 20, 3], "name": ["a", "b", "c", "d"]})
+
+    assert list(actions) == ["done"] * 4
+    assert list(columns["x"]) == [16, 10, 40, 12]
+    assert list(columns["name"]) == ["a", "b", "c", "d"]
+    assert all(columns["big"])
+    # One call per sub-batch, not per record.
+    assert DoubleColumn.calls == 4
+
+    empty = {"x": [], "name": []}
+    actions, columns = flow.run_columns(
+        SharedData(config={"limit": 10}, cmpnt={}, state=None), empty)
+    assert len(actions) == 0
+    assert {k: list(v) for k, v in columns.items()} == empty
+    with pytest.raises(ValueError, match="equally long"):
+        flow.run_columns(SharedData(config={}, cmpnt={}, state=None),
+                         {"x": [1, 2], "name": ["a"]})
+    check.successors.clear()
+    double.successors.clear()
+
+
+def test_run_columns_carries_shared_keys_to_successors(monkeypatch):
+    """Top-level keys set by a node reach the nodes after it."""
+    # pylint: disable=C0415
+    import nethervortex
+    monkeypatch.setattr(nethervortex, "_np", None)
+
+    class TagBatch(Node):
+        """Tags the batch and splits it by parity."""
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            shared["tag"] = len(shared["columns"]["x"])
+            return ["odd" if v % 2 else "even" for v in shared["columns"]["x"]]
+
+    class ReadTag(Node):
+        """Records what it sees, then writes its own key."""
+        seen = []
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            ReadTag.seen.append((shared.get("tag"), shared.get("branch")))
+            shared["branch"] = len(shared["columns"]["x"])
+
+    tag, read = TagBatch(), ReadTag()
+    # pylint: disable=W0104
+    tag - "odd" >> read
+    tag - "even" >> read
+    Flow(start=tag).run_columns(
+        SharedData(config={}, cmpnt={}, state=None), {"x": [1, 2, 3]})
+    # Both splits see the tag, but not each other's branch key.
+    assert ReadTag.seen == [(3, None)] * 2
+    tag.successors.clear()
+
+
+@pytest.mark.parametrize("store", ["sqlite", "file"])
+def test_checkpointed_flow_resumes_after_crash(store, tmp_path):
+    """resume() continues after the last completed node."""
+
+    class ExpensiveNode(Node):
+        """Runs once and records it."""
+        COMP = "R"
+        runs = 0
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            ExpensiveNode.runs += 1
+            shared["cmpnt"]["R"]["embedded"] = True
+
+    class CrashingNode(Node):
+        """Crashes until told not to."""
+        COMP = "R"
+        crash = True
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            if CrashingNode.crash:
+                raise RuntimeError("power cut")
+            assert shared["cmpnt"]["R"]["embedded"]
+            return "finished"
+
+    checkpoints = (SQLiteCheckpoints(str(tmp_path / "ckpt.sqlite"))
+                   if store == "sqlite" else FileCheckpoints(tmp_path))
+    expensive, crashing = ExpensiveNode(), CrashingNode()
+    # pylint: disable=W0104
+    expensive >> crashing
+    flow = Flow(start=expensive, checkpoints=checkpoints)
+    shared = SharedData(config={}, cmpnt={"R": {}}, state=None)
+
+    with pytest.raises(RuntimeError):
+        flow.run(shared, run_id="run-1")
+    assert ExpensiveNode.runs == 1
+
+    CrashingNode.crash = False
+    restored = {}
+    assert flow.resume("run-1", restored) == "finished"
+    assert ExpensiveNode.runs == 1
+    assert restored["state"] == "CrashingNode"
+    # A finished run resumes to its result without running anything.
+    assert flow.resume("run-1") == "finished"
+    with pytest.raises(KeyError):
+        flow.resume("unknown")
+
+
+def test_delta_checkpoints_stay_small(tmp_path):
+    """Only changed entries are written between full snapshots."""
+
+    class StepNode(Node):
+        """Bumps a small counter next to a large, unchanging payload."""
+        COMP = "S"
+        crash_at = 7
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            comp = shared["cmpnt"]["S"]
+            comp["i"] += 1
+            if comp["i"] == StepNode.crash_at:
+                raise RuntimeError("crash")
+            return "again" if comp["i"] < 10 else "done"
+
+    step = StepNode()
+    step - "again" >> step
+    store = SQLiteCheckpoints(str(tmp_path / "ckpt.sqlite"), full_every=4)
+    flow = Flow(start=step, checkpoints=store)
+    big = {"blob": os.urandom(50_000).hex()}
+    shared = SharedData(config={}, cmpnt={"S": {"i": 0}, "Big": big},
+                        state=None)
+
+    with pytest.raises(RuntimeError):
+        flow.run(shared, run_id="r")
+
+    records = store.records("r")
+    assert [r[4] for r in records] == [True, False, False, False,
+                                       True, False]
+    full_size = len(records[0][5])
+    assert all(len(r[5]) * 50 < full_size for r in records[1:4])
+    # Resuming replays the last full snapshot plus one delta.
+    assert len(store.tail("r")) == 2
+
+    StepNode.crash_at = None
+    restored = {}
+    assert flow.resume("r", restored) == "done"
+    assert restored["cmpnt"]["S"]["i"] == 10
+    assert restored["cmpnt"]["Big"] == big
+    step.successors.clear()
+
+
+def test_profile_observer_counts_nodes_retries_and_transitions():
+    """ProfileObserver aggregates per-node timings, retries and edges."""
+
+    class LoopNode(Node):
+        """Loops three times, then hands over to a parallel step."""
+        COMP = "L"
+
+        # pylint: disable=W0613
+        def postlude(self, shared, prep_res, exec_res, **_):
+            comp = shared["cmpnt"]["L"]
+            comp["i"] += 1
+            return "again" if comp["i"] < 3 else "fan"
+
+    FlakyNode(retry_waits=[0])
+    loop = LoopNode()
+    loop - "again" >> loop
+    loop - "fan" >> ParallelStep(collect="all")[FlakyNode(), CountNode()]
+    flow = Flow(start=loop)
+
+    def shared():
+        return SharedData(config={}, cmpnt={"L": {"i": 0},
+                                            "F": {"attempts": 0},
+                                            "C": {"n": 0, "limit": 0}},
+                          state=None)
+
+    observer = flow.observe(ProfileObserver())
+    flow.run(shared())
+    stats = observer.snapshot()
+    assert stats["nodes"]["LoopNode"]["count"] == 3
+    assert stats["nodes"]["FlakyNode"]["count"] == 1
+    assert stats["nodes"]["CountNode"]["count"] == 1
+    assert stats["nodes"]["ParallelStep"]["wall"] >= 0
+    assert stats["retries"] == {"FlakyNode": 1}
+    assert stats["transitions"][("LoopNode", "again", "LoopNode")] == 2
+    assert stats["transitions"][("LoopNode", "fan", "ParallelStep")] == 1
+
+    list(flow.run_many([shared(), shared()], concurrency=2))
+    assert observer.snapshot()["nodes"]["LoopNode"]["count"] == 9
+
+    observer.reset()
+    flow.unobserve(observer)
+    flow.run(shared())
+    assert not observer.snapshot()["nodes"]
+    loop.successors.clear()
+
+
+def test_latency_histogram_percentiles():
+    """Quantiles stay within the histogram's relative error."""
+    hist = LatencyHistogram()
+    for i in range(1, 1001):
+        hist.record(i / 1000)
+    assert hist.count == 1000
+    assert hist.percentile(50) == pytest.approx(0.5, rel=0.04)
+    assert hist.percentile(99) == pytest.approx(0.99, rel=0.04)
+    assert hist.percentile(100) == pytest.approx(1.0, rel=0.04)
+    other = LatencyHistogram()
+    other.record(5.0)
+    assert hist.merge(other).max == 5.0
+    assert hist.summary()["count"] == 1001
+
+
+def test_flow_stats_histograms_and_reset():
+    """Flow.stats() reports per-phase histograms and action counts."""
+    FlakyNode(retry_waits=[0.01])
+    flow = Flow(start=FlakyNode(), stats=True)
+    for _ in range(3):
+        flow.run(SharedData(config={}, cmpnt={"F": {"attempts": 0}},
+                            state=None))
+
+    stats = flow.stats()
+    phases = stats["nodes"]["FlakyNode"]
+    assert set(phases) == {"node", "prelude", "dispatch", "postlude",
+                           "retry_wait"}
+    assert phases["node"].count == 3
+    assert phases["retry_wait"].percentile(99) == pytest.approx(0.01,
+                                                                rel=0.04)
+    assert phases["dispatch"].min >= 0.01
+    assert stats["transitions"] == {("FlakyNode", "2"): 3}
+
+    flow.stats(reset=True)
+    assert not flow.stats()["nodes"]
+    with pytest.raises(RuntimeError):
+        Flow(start=FlakyNode()).stats()
+
+
+def test_tracer_spans_follow_parallel_tasks(tmp_path):
+    """Parallel tasks are concurrent child spans of their step."""
+    FlakyNode(retry_waits=[0])
+    step = ParallelStep(collect="all")[FlakyNode(), CountNode()]
+    flow = Flow(start=step)
+    tracer = flow.observe(Tracer(JsonLinesExporter(tmp_path / "t.jsonl")))
+    chrome = flow.observe(Tracer(ChromeTraceExporter(tmp_path / "t.json")))
+    flow.run(SharedData(config={}, cmpnt={"F": {"attempts": 0},
+                                          "C": {"n": 0, "limit": 0}},
+                        state=None))
+    tracer.close()
+    chrome.close()
+
+    with open(tmp_path / "t.jsonl", encoding="utf-8") as f:
+        spans = {s["name"]: s for s in map(json.loads, f)
+                 if s["kind"] != "phase"}
+    root, parallel = spans["Flow"], spans["ParallelStep"]
+    assert root["parent_id"] is None
+    assert parallel["parent_id"] == root["span_id"]
+    for name in ("FlakyNode", "CountNode"):
+        assert spans[name]["parent_id"] == parallel["span_id"]
+        assert spans[name]["trace_id"] == root["trace_id"]
+        assert spans[name]["thread"] != root["thread"]
+
+    with open(tmp_path / "t.json", encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["args"]["attempt"] for e in events if e["name"] == "retry"] \
+        == [1]
+    assert {e["name"] for e in events
+            if e["cat"] == "phase" and e["ph"] == "X"} == {
+        "prelude", "dispatch", "postlude"}
+
+
+def test_tracer_sampling(tmp_path):
+    """Unsampled runs, and everything below them, record no spans."""
+    flow = Flow(start=Flow(start=CountNode()))
+    tracer = flow.observe(Tracer(JsonLinesExporter(tmp_path / "t.jsonl"),
+                                 sample_rate=0))
+    for _ in range(5):
+        flow.run(SharedData(config={}, cmpnt={"C": {"n": 0, "limit": 0}},
+                            state=None))
+    assert os.path.getsize(tmp_path / "t.jsonl") == 0
+    tracer.sample_rate = 1
+    flow.run(SharedData(config={}, cmpnt={"C": {"n": 0, "limit": 0}},
+                        state=None))
+    tracer.close()
+    with open(tmp_path / "t.jsonl", encoding="utf-8") as f:
+        kinds = [json.loads(line)["kind"] for line in f]
+    assert kinds.count("flow") == 2 and kinds.count("node") == 2
+
+
+def test_critical_path_follows_the_slowest_branch():
+    """The slow parallel branch, not the fast one, is on the path."""
+
+    class Lead(Node):
+        """Runs before the parallel step."""
+        # pylint: disable=W0613
+        def dispatch(self, prelude_res, **_):
+            time.sleep(0.02)
+
+    class SlowBranch(Node):
+        """The branch the step waits for."""
+        # pylint: disable=W0613
+        def dispatch(self, prelude_res, **_):
+            time.sleep(0.1)
+
+    class FastBranch(Node):
+        """A branch that finishes early."""
+        # pylint: disable=W0613
+        def dispatch(self, prelude_res, **_):
+            time.sleep(0.01)
+
+    lead = Lead()
+    lead >> ParallelStep(collect="all")[FastBranch(), SlowBranch()]
+    flow = Flow(start=lead)
+    stats = CriticalPathStats()
+    flow.observe(Tracer(stats))
+    for _ in range(2):
+        flow.run(SharedData(config={}, cmpnt={}, state=None))
+
+    names = [name for name, _ in stats.last_path]
+    assert names.index("Lead") < names.index("SlowBranch")
+    assert "FastBranch" not in names
+    assert stats.runs == 2
+    shares = stats.shares()
+    assert next(iter(shares)) == "SlowBranch"
+    assert shares["SlowBranch"] > 0.6
+    assert sum(shares.values()) == pytest.approx(1.0)
+    lead.successors.clear()
+
+
+PROFILED_FLOW = """
+from nethervortex import Flow, Node
+
+class Squares(Node):
+    COMP = "S"
+
+    def prelude(self, shared, **_):
+        return shared["cmpnt"]["S"]["n"]
+
+    def dispatch(self, prelude_res, **_):
+        return [i * i for i in range(prelude_res)]
+
+def build():
+    return Flow(start=Squares())
+"""
+
+
+def test_profile_command(tmp_path, monkeypatch, capsys):
+    """``python -m nethervortex profile`` reports per-node breakdowns."""
+    (tmp_path / "profiled_flow.py").write_text(PROFILED_FLOW)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "shared.json").write_text(json.dumps(
+        {"config": {}, "cmpnt": {"S": {"n": 100}}, "state": None}))
+
+    assert main(["profile", "profiled_flow:build",
+                 "--input", str(tmp_path / "shared.json"), "--runs", "20",
+                 "--alloc-runs", "5", "--json", str(tmp_path / "r.json"),
+                 "--cprofile", str(tmp_path / "hooks.prof"),
+                 "--collapsed", str(tmp_path / "stacks.txt")]) == 0
+
+    assert "Squares" in capsys.readouterr().out
+    with open(tmp_path / "r.json", encoding="utf-8") as f:
+        report = json.load(f)
+    node = report["nodes"]["Squares"]
+    assert node["count"] == 20
+    assert node["share"] == 1.0
+    assert node["alloc_bytes_per_call"] < 1000
+    assert node["alloc_blocks_per_call"] < 10
+    # pylint: disable=W0212,C0415
+    from nethervortex import _profiler_lines
+    own = {f"{name}:{line}" for name, line in _profiler_lines()}
+    assert not any(site["site"] in own for site in report["alloc_sites"])
+    assert {"node", "prelude", "dispatch"} <= set(node["phases"])
+    stacks = (tmp_path / "stacks.txt").read_text().splitlines()
+    assert any(line.startswith("Flow;Squares;dispatch ") for line in stacks)
+    assert all(line.split()[0].rsplit(";", 1)[1] in
+               ("prelude", "dispatch", "postlude") for line in stacks)
+    assert (tmp_path / "hooks.prof").stat().st_size > 0
+
+    with pytest.raises(SystemExit):
+        main(["profile", "profiled_flow:build", "--runs", "0",
+              "--input", str(tmp_path / "shared.json")])
+    with pytest.raises(SystemExit):
+        main(["profile", "profiled_flow:build", "--alloc-runs", "-1",
+              "--input", str(tmp_path / "shared.json")])